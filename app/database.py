@@ -1,11 +1,63 @@
-from sqlalchemy import create_engine
+import os
+from typing import AsyncIterator
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-DATABASE_URL = "sqlite:///./db/roamly.db"
+load_dotenv(override=True)
 
+DATABASE_PATH = os.getenv("DATABASE_PATH", "./db/roamly.db")
+DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DATABASE_PATH}"
+
+# Applied to every new connection. WAL lets readers proceed while a write is in progress;
+# NORMAL sync is durable across app crashes under WAL and skips an fsync per commit.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+    # Negative cache_size is in KiB.
+    "cache_size": -int(os.getenv("SQLITE_CACHE_KB", 64 * 1024)),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_BYTES", 256 * 1024 * 1024)),
+    "temp_store": "MEMORY",
+}
+
+def apply_sqlite_pragmas(dbapi_connection, _connection_record=None):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+# Request handlers use the async engine. The sync engine serves code that already runs in
+# worker threads: agent tools, index warm-up, LangChain's SQLDatabase and the setup scripts.
+# SQLite takes one writer at a time, so the pools only need to cover concurrent readers.
 engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
+    DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=int(os.getenv("DB_SYNC_POOL_SIZE", 5)),
+    max_overflow=int(os.getenv("DB_SYNC_MAX_OVERFLOW", 5)),
+    pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", 10)),
 )
+event.listen(engine, "connect", apply_sqlite_pragmas)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=int(os.getenv("DB_POOL_SIZE", 10)),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+    pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", 10)),
+)
+event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    """Request-scoped async session shared by all routers."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def close_db():
+    await async_engine.dispose()
+    engine.dispose()
@@ -1,23 +1,35 @@
-from sqlalchemy import Column, Integer, String, Text, Float, ForeignKey
-from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy import Column, Integer, String, Text, Float, ForeignKey, LargeBinary
+from sqlalchemy.orm import relationship
 from pydantic import BaseModel
 from typing import List, Optional
-
-Base = declarative_base()
+from app.database import Base
 
 class Trip(Base):
     __tablename__ = "trips"
     trip_id = Column(Integer, primary_key=True, autoincrement=True)
     title = Column(String, nullable=False)
     description = Column(Text)
-    duration = Column(Integer)
-    num_people = Column(Integer)
-    activity_level = Column(String)
-    budget = Column(Float)
+    duration = Column(Integer, index=True)
+    num_people = Column(Integer, index=True)
+    activity_level = Column(String, index=True)
+    budget = Column(Float, index=True)
     cities = Column(String)
     lat = Column(Float)
     lng = Column(Float)
-    embedding = Column(Text)
+    embedding = Column(LargeBinary)
+
+class City(Base):
+    __tablename__ = "cities"
+    # worldcities' id, kept so re-imports update rows in place.
+    city_id = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String, nullable=False, index=True)
+    name_ascii = Column(String)
+    country = Column(String, index=True)
+    iso2 = Column(String)
+    admin_name = Column(String)
+    lat = Column(Float)
+    lon = Column(Float)
+    population = Column(Integer, index=True)
 
 class TripCreate(BaseModel):
     title: str
@@ -44,9 +56,53 @@ class TripRead(BaseModel):
 
     model_config = dict(from_attributes=True)
 
+class TripSearchFilters(BaseModel):
+    min_budget: Optional[float] = None
+    max_budget: Optional[float] = None
+    min_duration: Optional[int] = None
+    max_duration: Optional[int] = None
+    activity_level: Optional[str] = None
+    num_people: Optional[int] = None
+    cities: Optional[List[str]] = None
+
+    def is_empty(self) -> bool:
+        return not any(value not in (None, []) for value in self.model_dump().values())
+
+class MapMarker(BaseModel):
+    trip_id: int
+    title: str
+    lat: float
+    lng: float
+
+class MapCluster(BaseModel):
+    count: int
+    lat: float
+    lng: float
+
+class MapResponse(BaseModel):
+    zoom: int
+    clusters: List[MapCluster] = []
+    markers: List[MapMarker] = []
+    truncated: bool = False
+
+class CitySuggestion(BaseModel):
+    city_id: int
+    name: str
+    country: Optional[str] = None
+    admin_name: Optional[str] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    population: Optional[int] = None
+
+class BulkImportResult(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[str] = []
+
 class ChatRequest(BaseModel):
     session_id: str
     message: str
+    stream: bool = False
 
 class Attraction(BaseModel):
     name: str
@@ -1,63 +1,169 @@
-from app.models import ChatRequest, ChatResponse, TripRequest, TripPlan
-from app.services.llm_service import llm_service
-from fastapi.responses import StreamingResponse
-from fastapi import APIRouter, HTTPException
+from app.models import ChatRequest, ChatResponse, TripRequest, TripPlan, DailyPlan
+from app.services.llm_service import get_llm_service
+from fastapi.responses import StreamingResponse, Response
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from typing import Callable, List, Optional
+from pydantic import ValidationError
+import asyncio
 import json
-from app.utils.sessions import get_history, update_session
+import os
+from app.utils.sessions import get_context, get_contexts, append_turn, schedule_summary
+from app.utils.pipeline import Stage, StageProgress, run_dag
+from app.utils.structured_output import JsonArrayStreamer, parse_model
+from app.utils.cancellation import ClientDisconnected, run_until_disconnect, stream_until_disconnect
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
+def sse_event(payload) -> str:
+    return f"data: {json.dumps(payload, default=str)}\n\n"
+
+def stage_output(result) -> str:
+    return result.get("output", str(result))
+
+# Not sent to anyone: the client is gone. Logged as nginx's "client closed request".
+CLIENT_CLOSED_REQUEST = 499
+
 @router.post("/text", response_model=ChatResponse)
-def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     query = request.message
-    history = get_history(request.session_id)
-    
-    response = llm_service.chat(query, history)
-    update_session(request.session_id, "user", query)
-    update_session(request.session_id, "assistant", response)
+    history = await asyncio.to_thread(get_context, request.session_id, "chat")
+    llm_service = await run_in_threadpool(get_llm_service)
+
+    if not request.stream:
+        try:
+            result = await run_until_disconnect(http_request, llm_service.run("chat", query, history), "/chat/text")
+        except ClientDisconnected:
+            return Response(status_code=CLIENT_CLOSED_REQUEST)
+        response = stage_output(result)
+        await asyncio.to_thread(append_turn, request.session_id, query, response)
+        schedule_summary(request.session_id, llm_service.summarize)
+        return ChatResponse(response=response)
+
+    async def event_stream():
+        response = ""
+        async for event in llm_service.stream("chat", query, history):
+            if event["type"] == "final":
+                response = event["output"]
+                yield sse_event({"stage": "chat", "result": response})
+            else:
+                yield sse_event({"stage": "chat", **event})
+        await asyncio.to_thread(append_turn, request.session_id, query, response)
+        schedule_summary(request.session_id, llm_service.summarize)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream_until_disconnect(http_request, event_stream(), "/chat/text"), media_type="text/event-stream")
+
+PLANNER_MAX_ATTEMPTS = int(os.getenv("PLANNER_MAX_ATTEMPTS", 2))
+
+def parse_trip_plan(text: str) -> Optional[TripPlan]:
+    """The planner's output as a TripPlan, repairing near-valid JSON locally; None if unusable."""
+    plan = parse_model(text, TripPlan)
+    return plan if plan is not None and plan.daily_plan else None
+
+def is_valid_plan(text: str) -> bool:
+    return parse_trip_plan(text) is not None
+
+def plan_day_events(streamer: JsonArrayStreamer, token: str) -> List[dict]:
+    """``day`` progress events for every daily_plan entry completed by ``token``."""
+    events = []
+    for item in streamer.feed(token):
+        try:
+            events.append({"type": "day", "day": DailyPlan.model_validate(item).model_dump()})
+        except ValidationError:
+            continue
+    return events
+
+def build_generate_pipeline(llm_service, query: str, history: Callable[[str], list], progress: Optional[asyncio.Queue] = None) -> List[Stage]:
+    """Stages of /chat/generate. Tips and risks only need the query, so they run alongside transport.
 
-    return ChatResponse(response=response)
+    ``history(agent)`` returns the conversation trimmed to that agent's token budget.
+
+    With a ``progress`` queue, every agent streams its tokens and tool calls onto it, tagged by stage.
+    """
+
+    async def run_agent(stage: str, agent: str, prompt: str, chat_history: list = None, inputs=None, cacheable=None, on_token=None) -> str:
+        """``on_token`` turns answer tokens into the stage's progress events instead of forwarding them.
+
+        Stages are cached by the user's query plus ``inputs``, the upstream outputs their prompt is built from.
+        """
+        if progress is None:
+            return stage_output(await llm_service.run(agent, prompt, chat_history, cache_key=query, cache_inputs=inputs, cacheable=cacheable))
+        output = ""
+        async for event in llm_service.stream(agent, prompt, chat_history, cache_key=query, cache_inputs=inputs, cacheable=cacheable):
+            if event["type"] == "final":
+                output = event["output"]
+            elif event["type"] == "token" and on_token is not None:
+                for item in on_token(event["token"]):
+                    await progress.put(StageProgress(stage, item))
+            else:
+                await progress.put(StageProgress(stage, event))
+        return output
+
+    async def transport(_):
+        return await run_agent("transport", "transport", query)
+
+    async def accommodation(deps):
+        return await run_agent("accommodation", "accommodation", f"Transport options: {deps['transport']}\n\nYour query: {query}",
+                               inputs={"transport": deps["transport"]})
+
+    async def plan(deps):
+        prompt = f"User query: {query}, Transport options: {deps['transport']}, Accommodation options: {deps['accommodation']}"
+        inputs = {"transport": deps["transport"], "accommodation": deps["accommodation"]}
+        for attempt in range(PLANNER_MAX_ATTEMPTS):
+            # Each completed day is streamed as soon as its closing brace arrives; a retry resends days by number.
+            streamer = JsonArrayStreamer("daily_plan")
+            plan_output = await run_agent("plan", "planner", prompt, history("planner"), inputs=inputs, cacheable=is_valid_plan,
+                                          on_token=lambda token: plan_day_events(streamer, token))
+            trip_plan = parse_trip_plan(plan_output)
+            if trip_plan is not None:
+                return trip_plan.model_dump_json()
+            print(f"[Warning] Planner output unusable on attempt {attempt+1}")
+            # The broken answer already holds the transport and hotel details, so only it is sent back.
+            prompt = f"Your previous answer is not a valid trip plan. Return it corrected as JSON only:\n{plan_output}"
+        raise ValueError(f"Planner did not return a valid trip plan after {PLANNER_MAX_ATTEMPTS} attempts")
+
+    async def tips(_):
+        return await run_agent("tips", "tips", f"User query: {query}", history("tips"))
+
+    async def risks(_):
+        return await run_agent("risks", "risks", f"User query: {query}", history("risks"))
+
+    return [
+        Stage("transport", transport),
+        Stage("accommodation", accommodation, deps=("transport",)),
+        Stage("plan", plan, deps=("transport", "accommodation")),
+        Stage("tips", tips),
+        Stage("risks", risks),
+    ]
 
 @router.post("/generate", response_model=TripPlan)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     query = request.message
-    history = get_history(request.session_id)
-    
-    plan_output = ""
-    async def event_stream():
-        transport_result = await llm_service.run("transport", query)
-        transport_output = transport_result.get("output", str(transport_result))
-        yield f"data: {json.dumps({'stage': 'transport', 'result': transport_output})}\n\n"
-
-        accommodation_result = await llm_service.run("accommodation", f"Transport options: {transport_output}\n\nYour query: {query}")
-        accommodation_output = accommodation_result.get("output", str(accommodation_result))
-        yield f"data: {json.dumps({'stage': 'accommodation', 'result': accommodation_output})}\n\n"
-
-        modified_query = query
-        for attempt in range(3):
-            plan_result = await llm_service.run("planner", f"User query: {modified_query}, Transport options: {transport_output}, Accommodation options: {accommodation_output}", history)
-            plan_output = plan_result.get("output", str(plan_result))
-            try:
-                trip_plan = json.loads(plan_output)
-                json_str = json.dumps(trip_plan)
-                yield f"data: {json.dumps({'stage': 'plan', 'result': plan_output})}\n\n"
-                break
-            except json.JSONDecodeError as e:
-                print(f"[Warning] Invalid JSON on attempt {attempt+1}: {e}")
-                modified_query = f"Previous output was invalid JSON:\n{plan_output}\nPlease return valid JSON only."
-
-        tips_result = await llm_service.run("tips", f"User query: {modified_query}", history)
-        tips_output = tips_result.get("output", str(tips_result))
-        yield f"data: {json.dumps({'stage': 'tips', 'result': tips_output})}\n\n"
-
-        risks_result = await llm_service.run("risks", f"User query: {query}", history)
-        risks_output = risks_result.get("output", str(risks_result))
-        yield f"data: {json.dumps({'stage': 'risks', 'result': risks_output})}\n\n"
+    # Contexts are taken now, before this turn is appended to the session.
+    history = await asyncio.to_thread(get_contexts, request.session_id, ("planner", "tips", "risks"))
 
-        yield "data: [DONE]\n\n"
+    llm_service = await run_in_threadpool(get_llm_service)
+    progress = asyncio.Queue() if request.stream else None
+    stages = build_generate_pipeline(llm_service, query, history.get, progress)
 
-    update_session(request.session_id, "user", query)
-    update_session(request.session_id, "assistant", plan_output)
+    async def event_stream():
+        plan_output = ""
+        async for stage, result in run_dag(stages, progress):
+            if isinstance(result, StageProgress):
+                yield sse_event({"stage": stage, **result.event})
+                continue
+            if isinstance(result, Exception):
+                print(f"[Warning] Stage {stage} failed: {result}")
+                yield sse_event({"stage": stage, "error": str(result)})
+                continue
+            if stage == "plan":
+                plan_output = result
+            yield sse_event({"stage": stage, "result": result})
 
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+        await asyncio.to_thread(append_turn, request.session_id, query, plan_output)
+        schedule_summary(request.session_id, llm_service.summarize)
+        yield "data: [DONE]\n\n"
 
+    # A disconnect cancels the running stages (and their agents' HTTP calls); the turn is not saved.
+    return StreamingResponse(stream_until_disconnect(http_request, event_stream(), "/chat/generate"), media_type="text/event-stream")
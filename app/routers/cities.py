@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Query
+from typing import List
+import app.models as models
+from app.services.city_service import city_index, city_index_component, refresh_city_index
+import asyncio
+
+router = APIRouter(prefix="/cities", tags=["cities"])
+_refresh_tasks = set()
+
+@router.get("/suggest", response_model=List[models.CitySuggestion])
+async def suggest_cities(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50)
+):
+    """Cities whose name starts with ``q`` (accent- and case-insensitive), most populous first."""
+    if not city_index_component.ready:
+        await asyncio.to_thread(city_index_component.get)
+    elif city_index.check_due():
+        # Picks up a re-import in the background; this request is answered from the current index.
+        task = asyncio.create_task(asyncio.to_thread(refresh_city_index))
+        _refresh_tasks.add(task)
+        task.add_done_callback(_refresh_tasks.discard)
+    return city_index.suggest(q, limit)
@@ -0,0 +1,51 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.utils.lazy import components, component_status, startup_report
+from app.services.embedding_service import embedding_service
+from app.services.llm_service import get_llm_service
+from app.utils.provider_cache import provider_cache
+from app.utils.llm_governor import llm_governor
+from app.utils.sessions import session_store
+from app.utils.cancellation import cancellation_stats
+from app.services.hotel_directory import hotel_directory
+from app.services.city_service import city_index
+import os
+
+router = APIRouter(prefix="/health", tags=["health"])
+
+def required_components():
+    return [name.strip() for name in os.getenv("READY_COMPONENTS", "vector_index").split(",") if name.strip()]
+
+@router.get("/live")
+def live():
+    return {"status": "ok"}
+
+@router.get("/ready")
+def ready():
+    """Report which lazily built components are warm; 503 until the required ones are."""
+    components = component_status()
+    required = required_components()
+    is_ready = all(components.get(name, {}).get("warm") for name in required)
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={"ready": is_ready, "required": required, "components": components}
+    )
+
+@router.get("/startup")
+def startup():
+    """Per-component and per-phase startup timings, for tracking cold-start regressions."""
+    return startup_report()
+
+@router.get("/metrics")
+def metrics():
+    return {
+        "embedding_cache": embedding_service.cache_stats(),
+        "embedding_batcher": embedding_service.batcher_stats(),
+        "llm_response_cache": get_llm_service().response_cache.stats() if components["llm_service"].ready else None,
+        "provider_cache": provider_cache.stats(),
+        "hotel_directory": hotel_directory.stats(),
+        "city_index": city_index.stats(),
+        "llm_governor": llm_governor.stats(),
+        "sessions": session_store.stats(),
+        "cancellations": cancellation_stats.stats(),
+    }
@@ -1,32 +1,128 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Request, Response
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 import app.models as models
-from app.database import SessionLocal
-from typing import List
+from app.database import get_db
+from typing import List, Optional
 from app.services.embedding_service import embedding_service
+from app.services.vector_search_service import vector_search_service
+from app.services.map_service import map_index, map_index_component, parse_bbox
+from app.utils.trip_import import detect_format, iter_trip_chunks
+from app.utils.cache import LRUCache
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+
+MAX_REPORTED_IMPORT_ERRORS = 50
+TRIP_LIST_COLUMNS = [getattr(models.Trip, field) for field in models.TripRead.model_fields]
+
+# Pre-serialized GET /trips/ pages: (fingerprint, cursor, limit) -> (body, gzipped body, etag, next cursor).
+trip_list_cache = LRUCache(max_size=128)
 
 router = APIRouter(prefix="/trips", tags=["trips"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def _serialize_trip_page(rows: List[dict]):
+    body = json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    etag = f'W/"{hashlib.sha1(body).hexdigest()}"'
+    return body, gzip.compress(body, compresslevel=6), etag
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip: listed (or covered by ``*``) without ``q=0``."""
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+    # An explicit gzip entry overrides the wildcard.
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+async def _render_trip_page(db: AsyncSession, cursor: Optional[int], limit: Optional[int]):
+    query = select(*TRIP_LIST_COLUMNS).order_by(models.Trip.trip_id)
+    if cursor is not None:
+        query = query.where(models.Trip.trip_id > cursor)
+    if limit is not None:
+        query = query.limit(limit + 1)
+    rows = [row._asdict() for row in await db.execute(query)]
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1]["trip_id"]
+
+    # Serializing and compressing a full catalog is CPU work; keep it off the event loop.
+    body, gzipped, etag = await asyncio.to_thread(_serialize_trip_page, rows)
+    return body, gzipped, etag, next_cursor
 
-@router.get("/")
-def get_all_trips(db: Session = Depends(get_db)):
-    trips = db.query(models.Trip).all()
-    return trips
+
+@router.get("/", response_model=List[models.TripRead])
+async def get_all_trips(
+    request: Request,
+    cursor: Optional[int] = Query(None, description="Return trips with trip_id greater than this"),
+    limit: Optional[int] = Query(None, ge=1, le=5000, description="Page size; omit for the full list"),
+    db: AsyncSession = Depends(get_db)
+):
+    """List trips without embeddings, served from a pre-serialized, pre-compressed cache.
+
+    The next page's cursor is returned in ``X-Next-Cursor``. Clients that send the
+    page's ETag back in ``If-None-Match`` get a bodiless 304 when nothing changed.
+    """
+    # Trips are insert-only, so the highest trip_id identifies the catalog version,
+    # including rows added by other workers.
+    fingerprint = (await db.execute(select(func.max(models.Trip.trip_id)))).scalar()
+    key = (fingerprint, cursor, limit)
+    page = trip_list_cache.get(key)
+    if page is None:
+        page = await _render_trip_page(db, cursor, limit)
+        trip_list_cache.set(key, page)
+    body, gzipped, etag, next_cursor = page
+
+    headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+
+    if _accepts_gzip(request.headers.get("accept-encoding", "")):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=gzipped, media_type="application/json", headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/map", response_model=models.MapResponse)
+async def get_map_trips(
+    bbox: str = Query(..., description="min_lng,min_lat,max_lng,max_lat"),
+    zoom: int = Query(..., ge=0, le=22)
+):
+    """Trips in the viewport: grid clusters at low zoom, individual markers at high zoom."""
+    try:
+        bounds = parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not map_index_component.ready:
+        await asyncio.to_thread(map_index_component.get)
+    return map_index.query(bounds, zoom)
 
 
 @router.post("/", response_model=models.TripRead)
-def create_trip(trip: models.TripCreate, db: Session = Depends(get_db)):
+async def create_trip(trip: models.TripCreate, db: AsyncSession = Depends(get_db)):
   
-    embedding_json = None
+    embedding = None
+    embedding_blob = None
     if trip.description:
-        embedding = embedding_service.generate_embedding(trip.description)
-        embedding_json = embedding_service.serialize_embedding(embedding)
+        embedding = await embedding_service.agenerate_embedding(trip.description)
+        embedding_blob = embedding_service.serialize_embedding(embedding)
 
     new_trip = models.Trip(
         title=trip.title,
@@ -38,11 +134,82 @@ def create_trip(trip: models.TripCreate, db: Session = Depends(get_db)):
         cities=trip.cities,
         lat=trip.lat,
         lng=trip.lng,
-        embedding=embedding_json
+        embedding=embedding_blob
     )
 
     db.add(new_trip)
-    db.commit()
-    db.refresh(new_trip)
+    await db.commit()
+    await db.refresh(new_trip)
+    trip_list_cache.clear()
+
+    if embedding is not None:
+        # The index backends take a sync Session; run_sync hands them one on this connection.
+        await db.run_sync(vector_search_service.add_trip, new_trip.trip_id, embedding)
+    map_index.add_trip(new_trip.trip_id, new_trip.title, new_trip.lat, new_trip.lng)
+
+    return new_trip
+
+
+@router.post("/bulk", response_model=models.BulkImportResult)
+async def bulk_import_trips(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, description="csv or jsonl; inferred from the file name if omitted"),
+    chunk_size: int = Query(500, ge=1, le=5000),
+    batch_size: int = Query(64, ge=1, le=512),
+    db: AsyncSession = Depends(get_db)
+):
+    """Stream trips from a CSV/JSONL upload, embedding and inserting one chunk per transaction."""
+    try:
+        fmt = detect_format(file.filename, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    chunks = iter_trip_chunks(stream, fmt, chunk_size)
+    inserted, errors = 0, []
+    try:
+        # Parsing and embedding are blocking, so each chunk is produced in a worker thread.
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            trips, chunk_errors = chunk
+            errors.extend(chunk_errors)
+            if not trips:
+                continue
+
+            described = [i for i, trip in enumerate(trips) if trip.description]
+            vectors = await asyncio.to_thread(
+                embedding_service.generate_embeddings, [trips[i].description for i in described], batch_size
+            )
+            embeddings = [None] * len(trips)
+            for i, vector in zip(described, vectors):
+                embeddings[i] = vector
+
+            rows = [
+                {**trip.model_dump(), "embedding": embedding_service.serialize_embedding(vector) if vector is not None else None}
+                for trip, vector in zip(trips, embeddings)
+            ]
+            trip_ids = (await db.execute(
+                insert(models.Trip).returning(models.Trip.trip_id, sort_by_parameter_order=True),
+                rows
+            )).scalars().all()
+            await db.commit()
+            trip_list_cache.clear()
+            inserted += len(trip_ids)
+
+            for trip_id, trip in zip(trip_ids, trips):
+                map_index.add_trip(trip_id, trip.title, trip.lat, trip.lng)
 
-    return new_trip
\ No newline at end of file
+            await db.run_sync(
+                vector_search_service.add_trips,
+                [trip_id for trip_id, vector in zip(trip_ids, embeddings) if vector is not None],
+                [vector for vector in embeddings if vector is not None]
+            )
+    except (ValueError, UnicodeDecodeError) as e:
+        errors.append(f"Import stopped: {e}")
+    finally:
+        stream.detach()
+
+    return models.BulkImportResult(
+        inserted=inserted,
+        failed=len(errors),
+        errors=errors[:MAX_REPORTED_IMPORT_ERRORS]
+    )
@@ -1,22 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from passlib.context import CryptContext
 import app.models as models
-from app.database import SessionLocal
+from app.database import get_db
 
 router = APIRouter(prefix="/users", tags=["users"])
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.post("/", response_model=models.UserRead)
-def create_user(user: models.UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(models.User).filter(models.User.email == user.email).first()
+async def create_user(user: models.UserCreate, db: AsyncSession = Depends(get_db)):
+    existing = (await db.execute(select(models.User).where(models.User.email == user.email))).scalars().first()
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
 
@@ -27,6 +21,6 @@ def create_user(user: models.UserCreate, db: Session = Depends(get_db)):
         pass_hash=hashed_password
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
@@ -0,0 +1,161 @@
+import heapq
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+from app.database import SessionLocal, engine
+from app.utils.lazy import LazyComponent
+from app import models
+
+# Prefixes up to this length get their best matches precomputed: short prefixes match
+# thousands of cities, so ranking them on every keystroke would dominate the lookup.
+TOP_PREFIX_LEN = 3
+MAX_SUGGESTIONS = 10
+# How often a running server looks for a newer city import to rebuild from.
+CITY_INDEX_CHECK_INTERVAL = float(os.getenv("CITY_INDEX_CHECK_INTERVAL", 60))
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+def fold(text: str) -> str:
+    """Accent- and case-insensitive key: "São Paulo" and "sao-paulo" both fold to "sao paulo"."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return _NON_ALNUM.sub(" ", stripped).strip()
+
+class CityIndex:
+    """Prefix index over city names, ranked by population.
+
+    Folded names (plus ASCII spellings that fold differently) are kept in one sorted list,
+    with a parallel array pointing at the city rows. A prefix query is a bisect into that
+    list; for prefixes of up to ``TOP_PREFIX_LEN`` characters the answer is precomputed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cities: List[tuple] = []
+        self._keys: List[str] = []
+        self._positions = array("i")
+        self._top: Dict[str, array] = {}
+        self._loaded = False
+        self._stamp: Optional[float] = None
+        self._checked_at = 0.0
+
+    @staticmethod
+    def import_stamp(db: Session) -> Optional[float]:
+        """When the cities table was last imported (``db/setup_db.py import-cities``), or None."""
+        if not inspect(engine).has_table("cities_import"):
+            return None
+        return db.execute(text("SELECT imported_at FROM cities_import WHERE import_id = 1")).scalar()
+
+    def build(self, db: Session):
+        stamp = self.import_stamp(db)
+        if not inspect(engine).has_table(models.City.__tablename__):
+            rows = []
+        else:
+            rows = (
+                db.query(
+                    models.City.city_id, models.City.name, models.City.country, models.City.admin_name,
+                    models.City.lat, models.City.lon, models.City.population, models.City.name_ascii
+                )
+                .order_by(models.City.population.desc().nulls_last(), models.City.name)
+                .all()
+            )
+
+        # Rows are in rank order, so a city's position doubles as its rank.
+        cities = [tuple(row[:7]) for row in rows]
+        entries: List[Tuple[str, int]] = []
+        top: Dict[str, List[int]] = {}
+        for position, row in enumerate(rows):
+            keys = {fold(row.name)}
+            if row.name_ascii:
+                keys.add(fold(row.name_ascii))
+            keys.discard("")
+            for key in keys:
+                entries.append((key, position))
+            for prefix in {key[:n] for key in keys for n in range(1, min(len(key), TOP_PREFIX_LEN) + 1)}:
+                best = top.setdefault(prefix, [])
+                if len(best) < MAX_SUGGESTIONS:
+                    best.append(position)
+        entries.sort()
+
+        with self._lock:
+            self._cities = cities
+            self._keys = [key for key, _ in entries]
+            self._positions = array("i", (position for _, position in entries))
+            self._top = {prefix: array("i", positions) for prefix, positions in top.items()}
+            self._stamp = stamp
+            self._checked_at = time.monotonic()
+            self._loaded = True
+        print(f"City index built with {len(cities)} cities")
+
+    def ensure(self, db: Session):
+        if not self._loaded:
+            self.build(db)
+
+    def invalidate(self):
+        """Rebuild on the next ``ensure`` or ``refresh``; the current index keeps serving until then."""
+        with self._lock:
+            self._loaded = False
+            self._checked_at = 0.0
+
+    def check_due(self) -> bool:
+        """True at most once per ``CITY_INDEX_CHECK_INTERVAL``; the caller should then run ``refresh``."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at < CITY_INDEX_CHECK_INTERVAL:
+                return False
+            self._checked_at = now
+            return True
+
+    def refresh(self, db: Session):
+        """Rebuild if invalidated or if the cities table was re-imported since the last build."""
+        if not self._loaded or self.import_stamp(db) != self._stamp:
+            self.build(db)
+
+    def suggest(self, query: str, limit: int = MAX_SUGGESTIONS) -> List[dict]:
+        prefix = fold(query)
+        if not prefix:
+            return []
+        with self._lock:
+            if len(prefix) <= TOP_PREFIX_LEN and limit <= MAX_SUGGESTIONS:
+                positions = list(self._top.get(prefix, ()))[:limit]
+            else:
+                start = bisect_left(self._keys, prefix)
+                end = bisect_left(self._keys, prefix + "\uffff", start)
+                positions = heapq.nsmallest(limit, set(self._positions[start:end]))
+            cities = [self._cities[position] for position in positions]
+        return [
+            {"city_id": city_id, "name": name, "country": country, "admin_name": admin_name,
+             "lat": lat, "lon": lon, "population": population}
+            for city_id, name, country, admin_name, lat, lon, population in cities
+        ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cities": len(self._cities), "keys": len(self._keys), "top_prefixes": len(self._top)}
+
+city_index = CityIndex()
+
+def _warm_city_index():
+    db = SessionLocal()
+    try:
+        city_index.ensure(db)
+    finally:
+        db.close()
+
+def refresh_city_index():
+    db = SessionLocal()
+    try:
+        city_index.refresh(db)
+    except Exception as e:
+        print(f"[Warning] City index refresh failed: {e}")
+    finally:
+        db.close()
+
+city_index_component = LazyComponent("city_index", _warm_city_index)
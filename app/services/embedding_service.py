@@ -1,21 +1,222 @@
 from langchain_huggingface import HuggingFaceEmbeddings
-from typing import List
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple, Union
+from dotenv import load_dotenv
+from app.utils.cache import LRUCache
+from app.utils.lazy import LazyComponent
+import numpy as np
+import asyncio
 import json
+import os
+import queue
+import threading
+import time
+
+load_dotenv(override=True)
+
+# Packed embedding layout: 3-byte magic, 1-byte format version, then little-endian float32 values.
+EMBEDDING_MAGIC = b"RVE"
+EMBEDDING_FORMAT_VERSION = 1
+EMBEDDING_HEADER = EMBEDDING_MAGIC + bytes([EMBEDDING_FORMAT_VERSION])
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+class EmbeddingBatcher:
+    """Single worker thread that coalesces embedding requests into batched forward passes.
+
+    Requests arriving within ``max_wait`` seconds of the first one in a batch (up to
+    ``max_batch_size``) share one ``embed_documents`` call; each caller gets its vector
+    through its own future.
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str]], List[List[float]]], max_batch_size: int = 32, max_wait: float = 0.005):
+        self._embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._start_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_observed_batch = 0
+        self.last_batch_size = 0
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        self._ensure_started()
+        self._queue.put((text, future))
+        return future
+
+    def _collect(self) -> List[Tuple[str, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = [(text, future) for text, future in self._collect() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            unique_texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = dict(zip(unique_texts, self._embed_batch(unique_texts)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for text, future in batch:
+                future.set_result(vectors[text])
+            with self._stats_lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.last_batch_size = len(batch)
+                self.max_observed_batch = max(self.max_observed_batch, len(batch))
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+                "last_batch_size": self.last_batch_size,
+                "max_batch_size_seen": self.max_observed_batch,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+            }
 
 class EmbeddingService:
-    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
-        self.embeddings = HuggingFaceEmbeddings(model_name=model_name)
-    
+    def __init__(
+        self,
+        model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+        cache_size: Optional[int] = None,
+        cache_ttl: Optional[float] = None
+    ):
+        self.model_name = model_name
+        self._model = LazyComponent("embedding_model", lambda: HuggingFaceEmbeddings(model_name=model_name))
+        self.cache = LRUCache(
+            max_size=cache_size if cache_size is not None else int(os.getenv("EMBEDDING_CACHE_SIZE", 2048)),
+            ttl=cache_ttl if cache_ttl is not None else float(os.getenv("EMBEDDING_CACHE_TTL", 0))
+        )
+        self.batcher: Optional[EmbeddingBatcher] = None
+        if os.getenv("EMBEDDING_BATCHING", "true").lower() in ("1", "true", "yes"):
+            self.batcher = EmbeddingBatcher(
+                self._embed_uncached,
+                max_batch_size=int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", 32)),
+                max_wait=float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", 5)) / 1000
+            )
+
+    @property
+    def embeddings(self) -> HuggingFaceEmbeddings:
+        """The HuggingFace model, loaded on first use rather than at import."""
+        return self._model.get()
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        # MiniLM is uncased, so case and whitespace differences yield the same vector.
+        return " ".join(text.lower().split())
+
+    def _cache_key(self, text: str):
+        return (self.model_name, self.normalize_text(text))
+
+    def _embed_uncached(self, texts: List[str], cache: bool = True) -> List[List[float]]:
+        vectors = self.embeddings.embed_documents(texts)
+        if cache:
+            for text, vector in zip(texts, vectors):
+                self.cache.set(self._cache_key(text), tuple(vector))
+        return vectors
+
     def generate_embedding(self, text: str) -> List[float]:
-        return self.embeddings.embed_query(text)
-    
+        cached = self.cache.get(self._cache_key(text))
+        if cached is not None:
+            return list(cached)
+        if self.batcher is not None:
+            return self.batcher.submit(text).result()
+        return self._embed_uncached([text])[0]
+
+    async def agenerate_embedding(self, text: str) -> List[float]:
+        """Async variant: cache hits return immediately, misses join the next micro-batch."""
+        cached = self.cache.get(self._cache_key(text))
+        if cached is not None:
+            return list(cached)
+        if self.batcher is not None:
+            return await asyncio.wrap_future(self.batcher.submit(text))
+        return (await asyncio.to_thread(self._embed_uncached, [text]))[0]
+
+    def generate_embeddings(self, texts: List[str], batch_size: int = 64, cache: bool = False) -> List[List[float]]:
+        """Embed many texts, running uncached ones through the model ``batch_size`` at a time.
+
+        These are usually one-off document texts (imports, setup), so their vectors are not
+        added to the query-embedding cache unless ``cache`` is set.
+        """
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        pending = {}
+        for i, text in enumerate(texts):
+            key = self._cache_key(text)
+            cached = self.cache.get(key)
+            if cached is not None:
+                results[i] = list(cached)
+            else:
+                pending.setdefault(key, (text, []))[1].append(i)
+
+        items = list(pending.items())
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            vectors = self._embed_uncached([text for _, (text, _) in batch], cache=cache)
+            for (_, (_, positions)), vector in zip(batch, vectors):
+                for i in positions:
+                    results[i] = vector
+        return results
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats()
+
+    def batcher_stats(self) -> Optional[dict]:
+        return self.batcher.stats() if self.batcher is not None else None
+
     def generate_trip_text(self, trip_data: dict) -> str:
         return trip_data.get('description', '')
-    
-    def serialize_embedding(self, embedding: List[float]) -> str:
-        return json.dumps(embedding)
-    
-    def deserialize_embedding(self, embedding_str: str) -> List[float]:
-        return json.loads(embedding_str)
+
+    def serialize_embedding(self, embedding: List[float]) -> bytes:
+        return EMBEDDING_HEADER + np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+    def deserialize_embedding(self, embedding_data: Union[bytes, str]) -> np.ndarray:
+        """Decode a stored embedding into a read-only float32 view.
+
+        Packed rows are decoded with ``np.frombuffer`` (no copy); legacy JSON rows written
+        before the binary format are still accepted until ``migrate_embeddings`` has run.
+        """
+        if is_packed_embedding(embedding_data):
+            version = embedding_data[len(EMBEDDING_MAGIC)]
+            if version != EMBEDDING_FORMAT_VERSION:
+                raise ValueError(f"Unsupported embedding format version: {version}")
+            return np.frombuffer(embedding_data, dtype=EMBEDDING_DTYPE, offset=len(EMBEDDING_HEADER))
+        if isinstance(embedding_data, (bytes, bytearray, memoryview)):
+            embedding_data = bytes(embedding_data).decode("utf-8")
+        return np.asarray(json.loads(embedding_data), dtype=np.float32)
+
+def is_packed_embedding(embedding_data) -> bool:
+    return (
+        isinstance(embedding_data, (bytes, bytearray, memoryview))
+        and bytes(embedding_data[:len(EMBEDDING_MAGIC)]) == EMBEDDING_MAGIC
+    )
 
 embedding_service = EmbeddingService()
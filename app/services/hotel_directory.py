@@ -0,0 +1,150 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from app.database import DATABASE_PATH
+from app.utils.amadeus_client import get_amadeus
+
+load_dotenv(override=True)
+
+schema = """
+CREATE TABLE IF NOT EXISTS hotel_directory (
+    city_code TEXT NOT NULL,
+    hotel_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT,
+    lat REAL,
+    lng REAL,
+    PRIMARY KEY (city_code, hotel_id)
+);
+CREATE TABLE IF NOT EXISTS hotel_directory_refresh (
+    city_code TEXT PRIMARY KEY,
+    refreshed_at REAL NOT NULL,
+    hotel_count INTEGER NOT NULL
+);
+"""
+
+class HotelDirectory:
+    """Local copy of Amadeus' hotel list per IATA city code.
+
+    The list barely changes, so it is fetched once per city, kept in SQLite and in memory,
+    and refreshed in the background once older than ``ttl``. Hotel searches then only need
+    the pricing call.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None):
+        self.path = path or os.getenv("HOTEL_DIRECTORY_PATH", DATABASE_PATH)
+        self.ttl = ttl if ttl is not None else float(os.getenv("HOTEL_DIRECTORY_TTL", 7 * 24 * 60 * 60))
+        self._local = threading.local()
+        self._memory: Dict[str, Tuple[float, List[str]]] = {}
+        self._fills: Dict[str, asyncio.Future] = {}
+        self._tasks = set()
+        self.hits = 0
+        self.fills = 0
+        self.refreshes = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.executescript(schema)
+            self._local.conn = conn
+        return conn
+
+    def _read(self, city_code: str) -> Optional[Tuple[float, List[str]]]:
+        conn = self._conn()
+        row = conn.execute("SELECT refreshed_at FROM hotel_directory_refresh WHERE city_code = ?", (city_code,)).fetchone()
+        if row is None:
+            return None
+        ids = [hotel_id for (hotel_id,) in conn.execute(
+            "SELECT hotel_id FROM hotel_directory WHERE city_code = ? ORDER BY position", (city_code,)
+        )]
+        return row[0], ids
+
+    def _write(self, city_code: str, hotels: List[dict]) -> Tuple[float, List[str]]:
+        refreshed_at = time.time()
+        rows = [
+            (city_code, hotel["hotelId"], position, hotel.get("name"),
+             hotel.get("geoCode", {}).get("latitude"), hotel.get("geoCode", {}).get("longitude"))
+            for position, hotel in enumerate(hotels) if hotel.get("hotelId")
+        ]
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM hotel_directory WHERE city_code = ?", (city_code,))
+            conn.executemany(
+                "INSERT OR IGNORE INTO hotel_directory (city_code, hotel_id, position, name, lat, lng) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO hotel_directory_refresh (city_code, refreshed_at, hotel_count) VALUES (?, ?, ?)",
+                (city_code, refreshed_at, len(rows))
+            )
+        return refreshed_at, [row[1] for row in rows]
+
+    async def _fetch(self, city_code: str) -> List[str]:
+        hotels = await get_amadeus().hotels_by_city(cityCode=city_code)
+        if not any(hotel.get("hotelId") for hotel in hotels):
+            # Not kept: an empty answer may be a wrong code or a provider hiccup, not a city without hotels.
+            return []
+        entry = await asyncio.to_thread(self._write, city_code, hotels)
+        self._memory[city_code] = entry
+        return entry[1]
+
+    async def _fill(self, city_code: str) -> List[str]:
+        # Concurrent first lookups of one city share a single Amadeus call.
+        pending = self._fills.get(city_code)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.ensure_future(self._fetch(city_code))
+        self._fills[city_code] = future
+        future.add_done_callback(lambda _: self._fills.pop(city_code, None))
+        return await asyncio.shield(future)
+
+    async def _refresh(self, city_code: str):
+        try:
+            await self._fill(city_code)
+            self.refreshes += 1
+        except Exception as e:
+            print(f"[Warning] Hotel directory refresh for {city_code} failed: {e}")
+
+    async def hotel_ids(self, city_code: str) -> List[str]:
+        """Hotel IDs in a city in Amadeus' order. Only the first lookup of a city waits on the API."""
+        city_code = city_code.strip().upper()
+        entry = self._memory.get(city_code)
+        if entry is None:
+            entry = await asyncio.to_thread(self._read, city_code)
+            if entry is not None:
+                self._memory[city_code] = entry
+        if entry is None:
+            self.fills += 1
+            return await self._fill(city_code)
+
+        self.hits += 1
+        if time.time() - entry[0] > self.ttl and city_code not in self._fills:
+            task = asyncio.create_task(self._refresh(city_code))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return entry[1]
+
+    def prefetch(self, city_code: str):
+        """Warm ``city_code`` in the background, e.g. from a transport search's destination; failures are only logged."""
+        city_code = city_code.strip().upper()
+        if len(city_code) != 3 or not city_code.isalpha() or city_code in self._memory or city_code in self._fills:
+            return
+        task = asyncio.create_task(self._prefetch(city_code))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _prefetch(self, city_code: str):
+        try:
+            await self.hotel_ids(city_code)
+        except Exception as e:
+            print(f"[Warning] Hotel directory prefetch for {city_code} failed: {e}")
+
+    def stats(self) -> dict:
+        return {"cities": len(self._memory), "hits": self.hits, "fills": self.fills, "refreshes": self.refreshes}
+
+hotel_directory = HotelDirectory()
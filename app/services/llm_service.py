@@ -1,8 +1,15 @@
 from langchain_openai import ChatOpenAI
 from langchain.agents import create_tool_calling_agent, AgentExecutor
-from typing import List, Dict, Optional, Tuple
-from app.utils.prompts import get_chat_prompts
+from typing import AsyncIterator, Callable, List, Dict, Optional, Tuple
+from app.utils.prompts import get_chat_prompts, HISTORY_SUMMARY_PROMPT
 from app.utils.tools import search_trips, get_sql_tool, search_transport, search_hotels, web_search
+from app.utils.lazy import LazyComponent
+from app.utils.structured_output import strict_json_schema
+from app.utils.llm_governor import governed_openai_kwargs
+from app.utils.cancellation import AgentUsageTracker, cancellation_stats
+from app.models import TripPlan
+from app.services.embedding_service import embedding_service
+from app.services.response_cache import SemanticResponseCache
 from dotenv import load_dotenv
 import asyncio
 import os
@@ -17,16 +24,31 @@ class LLMService:
         if not openai_api_key:
             raise ValueError("OPENAI_API_KEY not found in .env file")
         if not tavily_api_key:
-            raise ValueError("TAVILY_API_KEY not found in .env file")
+            print("[Warning] TAVILY_API_KEY not found in .env file; web_search will be unavailable")
         
 
         self.llm = ChatOpenAI(
             model="gpt-4o-mini",
             temperature=0.7,
-            api_key=openai_api_key
+            api_key=openai_api_key,
+            stream_usage=True,
+            **governed_openai_kwargs()
         )
 
+        # The planner's final answer is constrained to the TripPlan schema by the API itself.
+        self.planner_llm = ChatOpenAI(
+            model="gpt-4o-mini",
+            temperature=0.7,
+            api_key=openai_api_key,
+            model_kwargs={"response_format": strict_json_schema(TripPlan)},
+            stream_usage=True,
+            **governed_openai_kwargs()
+        )
+
+        self.summary_llm = self.llm.bind(max_tokens=int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", 400)), temperature=0)
+
         self.prompts = get_chat_prompts()
+        self.response_cache = SemanticResponseCache()
 
         sql_tools = get_sql_tool()
         transport_tools = [search_transport, web_search]
@@ -40,13 +62,13 @@ class LLMService:
             "chat": self._make_agent(common_tools, self.prompts["chat"]),
             "transport": self._make_agent(transport_tools, self.prompts["transport"]),
             "accommodation": self._make_agent(accommodation_tools, self.prompts["accomodation"]),
-            "planner": self._make_agent(planning_tools, self.prompts["planner"]),
+            "planner": self._make_agent(planning_tools, self.prompts["planner"], llm=self.planner_llm),
             "tips": self._make_agent(tips_tools, self.prompts["tips"]),
             "risks": self._make_agent(risks_tools, self.prompts["risks"]),
         }
 
-    def _make_agent(self, tools, prompt):
-        agent = create_tool_calling_agent(self.llm, tools, prompt)
+    def _make_agent(self, tools, prompt, llm=None):
+        agent = create_tool_calling_agent(llm or self.llm, tools, prompt)
         return AgentExecutor(
             agent=agent,
             tools=tools,
@@ -54,16 +76,113 @@ class LLMService:
             handle_parsing_errors=True
         )
     
-    async def run(self, stage: str, query: str, chat_history: List[Dict] = None):
-        return await self.agents[stage].ainvoke({
-            "input": query,
-            "chat_history": chat_history or []
-        })
+    async def _cached_output(
+        self, stage: str, cache_key: str, chat_history: List[Dict], cache_inputs: Optional[Dict[str, str]]
+    ) -> Tuple[Optional[str], Optional[List[float]]]:
+        """Return ``(cached output or None, key embedding)``; the embedding is reused to store a miss."""
+        if not self.response_cache.enabled_for(stage):
+            return None, None
+        embedding = await embedding_service.agenerate_embedding(cache_key)
+        output = await asyncio.to_thread(self.response_cache.lookup, stage, cache_key, embedding, chat_history, cache_inputs)
+        return output, embedding
+
+    async def _store_output(self, stage, cache_key, embedding, output, chat_history, cache_inputs, cacheable):
+        if embedding is None or not output or (cacheable is not None and not cacheable(output)):
+            return
+        await asyncio.to_thread(self.response_cache.store, stage, cache_key, embedding, output, chat_history, cache_inputs)
+
+    async def run(
+        self,
+        stage: str,
+        query: str,
+        chat_history: List[Dict] = None,
+        cache_key: Optional[str] = None,
+        cache_inputs: Optional[Dict[str, str]] = None,
+        cacheable: Optional[Callable[[str], bool]] = None
+    ):
+        """Run a stage's agent, serving near-duplicate requests from the semantic response cache.
+
+        ``cache_key`` is the text whose embedding identifies the request (defaults to ``query``);
+        ``cache_inputs`` are upstream stage outputs the prompt was built from, matched exactly;
+        ``cacheable`` can reject outputs that must not be reused, e.g. invalid JSON.
+        """
+        cache_key = cache_key or query
+        cached, embedding = await self._cached_output(stage, cache_key, chat_history, cache_inputs)
+        if cached is not None:
+            return {"input": query, "chat_history": chat_history or [], "output": cached, "cached": True}
+
+        tracker = AgentUsageTracker()
+        try:
+            result = await self.agents[stage].ainvoke(
+                {"input": query, "chat_history": chat_history or []},
+                config={"callbacks": [tracker]}
+            )
+        except asyncio.CancelledError:
+            cancellation_stats.record_cancelled(stage, tracker)
+            raise
+        cancellation_stats.record_completed(stage, tracker.tokens)
+        await self._store_output(stage, cache_key, embedding, result.get("output"), chat_history, cache_inputs, cacheable)
+        return result
     
-    def chat(self, query: str, chat_history: List[dict] = None):
-        return self.agents["chat"].invoke({
-            "input": query,
-            "chat_history": chat_history or []
-        })["output"]
+    async def stream(
+        self,
+        stage: str,
+        query: str,
+        chat_history: List[Dict] = None,
+        cache_key: Optional[str] = None,
+        cache_inputs: Optional[Dict[str, str]] = None,
+        cacheable: Optional[Callable[[str], bool]] = None
+    ) -> AsyncIterator[Dict]:
+        """Run a stage and yield progress as it happens, built on the agent's ``astream_events``.
+
+        Yields ``{"type": "token", "token": ...}`` for answer tokens, ``tool_start`` / ``tool_end``
+        for tool calls, and finally ``{"type": "final", "output": ...}`` with the same output
+        ``run`` would have returned. Cache hits yield only the final event.
+        """
+        cache_key = cache_key or query
+        cached, embedding = await self._cached_output(stage, cache_key, chat_history, cache_inputs)
+        if cached is not None:
+            yield {"type": "final", "output": cached, "cached": True}
+            return
+
+        output = None
+        tracker = AgentUsageTracker()
+        try:
+            async for event in self.agents[stage].astream_events(
+                {"input": query, "chat_history": chat_history or []},
+                config={"callbacks": [tracker]},
+                version="v2"
+            ):
+                kind = event["event"]
+                if kind == "on_chat_model_stream":
+                    token = event["data"]["chunk"].content
+                    if token:
+                        yield {"type": "token", "token": token}
+                elif kind == "on_tool_start":
+                    yield {"type": "tool_start", "tool": event["name"], "input": event["data"].get("input")}
+                elif kind == "on_tool_end":
+                    yield {"type": "tool_end", "tool": event["name"]}
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    result = event["data"].get("output")
+                    output = result.get("output", str(result)) if isinstance(result, dict) else str(result)
+        except (asyncio.CancelledError, GeneratorExit):
+            cancellation_stats.record_cancelled(stage, tracker)
+            raise
+        cancellation_stats.record_completed(stage, tracker.tokens)
+        await self._store_output(stage, cache_key, embedding, output, chat_history, cache_inputs, cacheable)
+        yield {"type": "final", "output": output or ""}
+
+    async def summarize(self, previous_summary: str, messages: List[Dict]) -> str:
+        """Fold ``messages`` into ``previous_summary`` for the token-budgeted session history."""
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        result = await self.summary_llm.ainvoke([
+            ("system", HISTORY_SUMMARY_PROMPT),
+            ("user", f"Current summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"),
+        ])
+        return result.content.strip()
+
+_llm_service = LazyComponent("llm_service", LLMService)
 
-llm_service = LLMService()
+def get_llm_service() -> LLMService:
+    """Shared LLMService; agents and SQL schema reflection are built on first use."""
+    return _llm_service.get()
@@ -0,0 +1,147 @@
+import math
+import threading
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.utils.lazy import LazyComponent
+from app import models
+
+# Grid cells per 256px map tile; 4 gives roughly 64px clusters on screen.
+CELLS_PER_TILE = 4
+# From this zoom level on, individual markers are returned instead of clusters.
+CLUSTER_MAX_ZOOM = 10
+MAX_MARKERS = 500
+MAX_CLUSTERS = 1000
+
+BBox = Tuple[float, float, float, float]
+
+def parse_bbox(bbox: str) -> BBox:
+    """Parse ``min_lng,min_lat,max_lng,max_lat``; ``min_lng > max_lng`` means the box crosses the antimeridian."""
+    parts = [float(part) for part in bbox.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox must be 'min_lng,min_lat,max_lng,max_lat'")
+    min_lng, min_lat, max_lng, max_lat = parts
+    if not (-90 <= min_lat <= max_lat <= 90) or not (-180 <= min_lng <= 180 and -180 <= max_lng <= 180):
+        raise ValueError("bbox is out of range")
+    return min_lng, min_lat, max_lng, max_lat
+
+def _split_antimeridian(bbox: BBox) -> List[BBox]:
+    min_lng, min_lat, max_lng, max_lat = bbox
+    if min_lng <= max_lng:
+        return [bbox]
+    return [(min_lng, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lng, max_lat)]
+
+class MapIndex:
+    """Multi-level grid index over trip coordinates.
+
+    For each zoom level below ``CLUSTER_MAX_ZOOM`` every occupied grid cell keeps a running
+    count and coordinate sums, so a viewport query only visits the cells it covers and its
+    cost is independent of catalog size. At ``CLUSTER_MAX_ZOOM`` cells hold lightweight markers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._levels: List[Dict[Tuple[int, int], List[float]]] = [{} for _ in range(CLUSTER_MAX_ZOOM)]
+        self._buckets: Dict[Tuple[int, int], List[dict]] = {}
+        self._loaded = False
+
+    @staticmethod
+    def _cell_size(zoom: int) -> float:
+        return 360.0 / (2 ** zoom) / CELLS_PER_TILE
+
+    @classmethod
+    def _cell(cls, zoom: int, lat: float, lng: float) -> Tuple[int, int]:
+        size = cls._cell_size(zoom)
+        return math.floor((lng + 180.0) / size), math.floor((lat + 90.0) / size)
+
+    def _insert(self, trip_id: int, title: str, lat: float, lng: float):
+        for zoom, level in enumerate(self._levels):
+            cell = level.setdefault(self._cell(zoom, lat, lng), [0, 0.0, 0.0])
+            cell[0] += 1
+            cell[1] += lat
+            cell[2] += lng
+        marker = {"trip_id": trip_id, "title": title, "lat": lat, "lng": lng}
+        self._buckets.setdefault(self._cell(CLUSTER_MAX_ZOOM, lat, lng), []).append(marker)
+
+    def build(self, db: Session):
+        rows = (
+            db.query(models.Trip.trip_id, models.Trip.title, models.Trip.lat, models.Trip.lng)
+            .filter(models.Trip.lat.isnot(None), models.Trip.lng.isnot(None))
+            .all()
+        )
+        with self._lock:
+            self._levels = [{} for _ in range(CLUSTER_MAX_ZOOM)]
+            self._buckets = {}
+            for trip_id, title, lat, lng in rows:
+                self._insert(trip_id, title, lat, lng)
+            self._loaded = True
+        print(f"Map index built with {len(rows)} trips")
+
+    def ensure(self, db: Session):
+        if not self._loaded:
+            self.build(db)
+
+    def add_trip(self, trip_id: int, title: str, lat: Optional[float], lng: Optional[float]):
+        if lat is None or lng is None:
+            return
+        with self._lock:
+            if self._loaded:
+                self._insert(trip_id, title, lat, lng)
+
+    def _cells_in_bbox(self, zoom: int, cells: dict, bbox: BBox):
+        """Yield occupied cells intersecting ``bbox``, scanning whichever is smaller: the box or the level."""
+        for min_lng, min_lat, max_lng, max_lat in _split_antimeridian(bbox):
+            x0, y0 = self._cell(zoom, min_lat, min_lng)
+            x1, y1 = self._cell(zoom, max_lat, max_lng)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(cells):
+                for x in range(x0, x1 + 1):
+                    for y in range(y0, y1 + 1):
+                        if (x, y) in cells:
+                            yield cells[(x, y)]
+            else:
+                for (x, y), value in cells.items():
+                    if x0 <= x <= x1 and y0 <= y <= y1:
+                        yield value
+
+    def query(self, bbox: BBox, zoom: int, max_markers: int = MAX_MARKERS, max_clusters: int = MAX_CLUSTERS) -> dict:
+        zoom = max(0, int(zoom))
+        with self._lock:
+            if zoom < CLUSTER_MAX_ZOOM:
+                # Too many clusters for the viewport: fall back to coarser grids until the payload fits.
+                level = zoom
+                while True:
+                    cells = list(self._cells_in_bbox(level, self._levels[level], bbox))
+                    if len(cells) <= max_clusters or level == 0:
+                        break
+                    level -= 1
+                clusters = [
+                    {"count": int(count), "lat": sum_lat / count, "lng": sum_lng / count}
+                    for count, sum_lat, sum_lng in cells[:max_clusters]
+                ]
+                return {"zoom": zoom, "clusters": clusters, "markers": [], "truncated": len(cells) > max_clusters}
+
+            markers, truncated = [], False
+            for bucket in self._cells_in_bbox(CLUSTER_MAX_ZOOM, self._buckets, bbox):
+                for marker in bucket:
+                    if any(
+                        min_lat <= marker["lat"] <= max_lat and min_lng <= marker["lng"] <= max_lng
+                        for min_lng, min_lat, max_lng, max_lat in _split_antimeridian(bbox)
+                    ):
+                        if len(markers) >= max_markers:
+                            truncated = True
+                            break
+                        markers.append(marker)
+                if truncated:
+                    break
+            return {"zoom": zoom, "clusters": [], "markers": markers, "truncated": truncated}
+
+map_index = MapIndex()
+
+def _warm_map_index():
+    db = SessionLocal()
+    try:
+        map_index.ensure(db)
+    finally:
+        db.close()
+
+map_index_component = LazyComponent("map_index", _warm_map_index)
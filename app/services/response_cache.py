@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+# Seconds each stage's answers stay valid. Tips and risks age slowly; prices do not.
+# 0 disables caching for a stage (chat answers depend on live trip data and the conversation).
+DEFAULT_STAGE_TTLS = {
+    "chat": 0,
+    "transport": 60 * 60,
+    "accommodation": 60 * 60,
+    "planner": 60 * 60,
+    "tips": 7 * 24 * 60 * 60,
+    "risks": 24 * 60 * 60,
+}
+
+# Stages whose prompt is built from other stages' outputs. Their entries are keyed on those
+# outputs too, and never live longer than the shortest-lived input.
+STAGE_INPUTS = {
+    "accommodation": ("transport",),
+    "planner": ("transport", "accommodation"),
+}
+
+_MONTHS = (
+    "january|february|march|april|may|june|july|august|september|october|november|december"
+    "|jan|feb|mar|apr|jun|jul|aug|sep|sept|oct|nov|dec"
+)
+# Numbers (prices, dates, party sizes) and month names: paraphrases may differ in wording, never in these.
+_LITERAL = re.compile(rf"\d+(?:[.,:/-]\d+)*|\b(?:{_MONTHS})\b", re.IGNORECASE)
+
+schema = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    stage TEXT NOT NULL,
+    context_hash TEXT NOT NULL,
+    query TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    output TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    last_hit REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_lookup ON llm_cache (stage, context_hash, expires_at);
+"""
+
+def literals(text: str) -> List[str]:
+    """Numbers and month names of ``text`` in order of appearance."""
+    return [match.lower() for match in _LITERAL.findall(text)]
+
+def context_hash(
+    chat_history: Optional[List[Dict]],
+    query: str = "",
+    inputs: Optional[Dict[str, str]] = None
+) -> str:
+    """Exact part of a cache key: the conversation, the query's dates and numbers, and upstream stage outputs.
+
+    Entries are only compared by embedding among those sharing this fingerprint, so "Rome in May"
+    never matches "Rome in June" however close their embeddings are.
+    """
+    payload = json.dumps(
+        {"history": chat_history or [], "literals": literals(query), "inputs": inputs or {}},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+class SemanticResponseCache:
+    """Persistent per-stage cache of agent outputs, matched by query-embedding cosine similarity.
+
+    Entries live in a small SQLite file shared by all workers. A lookup scores the live
+    entries of one stage (bounded by ``max_entries``) against the query embedding and
+    returns the best output above ``threshold``.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        threshold: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        stage_ttls: Optional[Dict[str, float]] = None
+    ):
+        self.path = path or os.getenv("LLM_CACHE_PATH", "./db/llm_cache.db")
+        self.threshold = threshold if threshold is not None else float(os.getenv("LLM_CACHE_THRESHOLD", 0.95))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("LLM_CACHE_MAX_ENTRIES", 500))
+        self.stage_ttls = dict(DEFAULT_STAGE_TTLS)
+        for stage in self.stage_ttls:
+            override = os.getenv(f"LLM_CACHE_TTL_{stage.upper()}")
+            if override is not None:
+                self.stage_ttls[stage] = float(override)
+        self.stage_ttls.update(stage_ttls or {})
+        for stage, inputs in STAGE_INPUTS.items():
+            input_ttls = [self.stage_ttls[name] for name in inputs if self.stage_ttls.get(name, 0) > 0]
+            if stage in self.stage_ttls and input_ttls:
+                self.stage_ttls[stage] = min([self.stage_ttls[stage], *input_ttls])
+
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(schema)
+            self._local.conn = conn
+        return conn
+
+    def _count(self, stage: str, metric: str, amount: int = 1):
+        with self._stats_lock:
+            counters = self._stats.setdefault(stage, {"hits": 0, "misses": 0, "stores": 0, "evictions": 0})
+            counters[metric] += amount
+
+    def enabled_for(self, stage: str) -> bool:
+        return self.stage_ttls.get(stage, 0) > 0
+
+    def lookup(
+        self,
+        stage: str,
+        query: str,
+        embedding: List[float],
+        chat_history: Optional[List[Dict]] = None,
+        inputs: Optional[Dict[str, str]] = None
+    ) -> Optional[str]:
+        if not self.enabled_for(stage):
+            return None
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT entry_id, embedding, output FROM llm_cache WHERE stage = ? AND context_hash = ? AND expires_at > ?",
+            (stage, context_hash(chat_history, query, inputs), time.time())
+        ).fetchall()
+        if not rows:
+            self._count(stage, "misses")
+            return None
+
+        matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype="<f4").reshape(len(rows), -1)
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self._count(stage, "misses")
+            return None
+
+        entry_id, _, output = rows[best]
+        conn.execute("UPDATE llm_cache SET hits = hits + 1, last_hit = ? WHERE entry_id = ?", (time.time(), entry_id))
+        conn.commit()
+        self._count(stage, "hits")
+        return output
+
+    def store(
+        self,
+        stage: str,
+        query: str,
+        embedding: List[float],
+        output: str,
+        chat_history: Optional[List[Dict]] = None,
+        inputs: Optional[Dict[str, str]] = None
+    ):
+        if not self.enabled_for(stage):
+            return
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO llm_cache (stage, context_hash, query, embedding, output, created_at, expires_at, last_hit) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (stage, context_hash(chat_history, query, inputs), query, vector.astype("<f4").tobytes(), output,
+             now, now + self.stage_ttls[stage], now)
+        )
+        evicted = conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,)).rowcount
+        evicted += conn.execute(
+            "DELETE FROM llm_cache WHERE stage = ? AND entry_id NOT IN "
+            "(SELECT entry_id FROM llm_cache WHERE stage = ? ORDER BY last_hit DESC LIMIT ?)",
+            (stage, stage, self.max_entries)
+        ).rowcount
+        conn.commit()
+        self._count(stage, "stores")
+        if evicted:
+            self._count(stage, "evictions", evicted)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._stats_lock:
+            return {stage: dict(counters) for stage, counters in self._stats.items()}
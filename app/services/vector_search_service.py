@@ -1,35 +1,362 @@
 import numpy as np
-from typing import List, Tuple
+import os
+import threading
+from typing import List, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import Float, and_, bindparam, column, event, func, or_, select, table, text
 from sqlalchemy.orm import Session
 from app.services.embedding_service import embedding_service
+from app.database import engine, async_engine, SessionLocal
+from app.utils.lazy import LazyComponent
 from app import models
 
+load_dotenv(override=True)
+
+TRIP_VEC_TABLE = "trip_embeddings"
+EMBEDDING_DIM = 384
+
+
+def load_sqlite_vec(conn):
+    """Load the sqlite-vec extension into a raw sqlite3 connection (or SQLAlchemy's aiosqlite adapter)."""
+    import sqlite_vec
+
+    driver = getattr(conn, "driver_connection", None)
+    if driver is not None and hasattr(conn, "await_"):
+        conn.await_(driver.enable_load_extension(True))
+        conn.await_(driver.load_extension(sqlite_vec.loadable_path()))
+        conn.await_(driver.enable_load_extension(False))
+        return
+    conn.enable_load_extension(True)
+    sqlite_vec.load(conn)
+    conn.enable_load_extension(False)
+
+
+def trip_vec_table_ddl(dim: int = EMBEDDING_DIM) -> str:
+    return (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TRIP_VEC_TABLE} USING vec0("
+        f"trip_id INTEGER PRIMARY KEY, embedding float[{dim}] distance_metric=cosine)"
+    )
+
+
+def pack_query_vector(embedding) -> bytes:
+    """Raw little-endian float32 bytes, the vector format vec0 accepts as a parameter."""
+    return np.asarray(embedding, dtype="<f4").tobytes()
+
+
+def escape_like(value: str) -> str:
+    """Make ``%`` and ``_`` in user input match literally in a LIKE pattern (escape character ``\\``)."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def trip_filter_clauses(filters: Optional[models.TripSearchFilters]) -> list:
+    """Translate structured search filters into SQL predicates on ``trips``."""
+    if filters is None:
+        return []
+    Trip = models.Trip
+    clauses = []
+    if filters.min_budget is not None:
+        clauses.append(Trip.budget >= filters.min_budget)
+    if filters.max_budget is not None:
+        clauses.append(Trip.budget <= filters.max_budget)
+    if filters.min_duration is not None:
+        clauses.append(Trip.duration >= filters.min_duration)
+    if filters.max_duration is not None:
+        clauses.append(Trip.duration <= filters.max_duration)
+    if filters.activity_level:
+        clauses.append(Trip.activity_level == filters.activity_level.strip().lower())
+    if filters.num_people is not None:
+        clauses.append(Trip.num_people == filters.num_people)
+    cities = [city.strip() for city in filters.cities or [] if city.strip()]
+    if cities:
+        clauses.append(or_(*[Trip.cities.ilike(f"%{escape_like(city)}%", escape="\\") for city in cities]))
+    return clauses
+
+
+class MemoryTripIndex:
+    """Resident, pre-normalized float32 matrix of trip embeddings plus a parallel trip_id array."""
+
+    def __init__(self, initial_capacity: int = 1024):
+        self._lock = threading.Lock()
+        self._initial_capacity = initial_capacity
+        self._matrix: Optional[np.ndarray] = None
+        self._trip_ids: Optional[np.ndarray] = None
+        self._size = 0
+        self._loaded = False
+        # Adds made while build() reads the table; replayed into the new arrays unless the read already saw them.
+        self._builds = 0
+        self._pending: List[Tuple[List[int], np.ndarray]] = []
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _reserve(self, dim: int, capacity: int):
+        """Grow the backing arrays (amortized doubling) so that ``capacity`` rows fit."""
+        if self._matrix is not None and self._matrix.shape[0] >= capacity:
+            return
+        new_capacity = max(capacity, self._initial_capacity)
+        if self._matrix is not None:
+            new_capacity = max(new_capacity, self._matrix.shape[0] * 2)
+        matrix = np.zeros((new_capacity, dim), dtype=np.float32)
+        trip_ids = np.zeros(new_capacity, dtype=np.int64)
+        if self._matrix is not None:
+            matrix[:self._size] = self._matrix[:self._size]
+            trip_ids[:self._size] = self._trip_ids[:self._size]
+        self._matrix = matrix
+        self._trip_ids = trip_ids
+
+    def _append(self, trip_ids: List[int], block: np.ndarray):
+        end = self._size + len(trip_ids)
+        self._reserve(block.shape[1], end)
+        self._matrix[self._size:end] = block
+        self._trip_ids[self._size:end] = trip_ids
+        self._size = end
+
+    def build(self, db: Session):
+        with self._lock:
+            self._builds += 1
+        try:
+            rows = (
+                db.query(models.Trip.trip_id, models.Trip.embedding)
+                .filter(models.Trip.embedding.isnot(None))
+                .all()
+            )
+            ids = [trip_id for trip_id, _ in rows]
+            vectors = [embedding_service.deserialize_embedding(embedding) for _, embedding in rows]
+
+            with self._lock:
+                self._matrix = None
+                self._trip_ids = None
+                self._size = 0
+                if vectors:
+                    self._append(ids, self._normalize(np.asarray(vectors, dtype=np.float32)))
+                seen = set(ids)
+                for pending_ids, block in self._pending:
+                    keep = [i for i, trip_id in enumerate(pending_ids) if trip_id not in seen]
+                    if keep:
+                        self._append([pending_ids[i] for i in keep], block[keep])
+                        seen.update(pending_ids[i] for i in keep)
+                self._loaded = True
+        finally:
+            with self._lock:
+                self._builds -= 1
+                if not self._builds:
+                    self._pending = []
+        print(f"Trip vector index built with {len(ids)} trips")
+
+    def ensure(self, db: Session):
+        if not self._loaded:
+            self.build(db)
+
+    def add_many(self, db: Session, trip_ids: List[int], embeddings: List[List[float]]):
+        if not trip_ids:
+            return
+        block = self._normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            if self._builds:
+                # A build may have read the table before these rows were committed.
+                self._pending.append((list(trip_ids), block))
+            if not self._loaded:
+                # The next search builds the full index, which already includes these rows.
+                return
+            self._append(trip_ids, block)
+
+    def _snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            if self._size == 0:
+                return np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int64)
+            return self._matrix[:self._size], self._trip_ids[:self._size]
+
+    def search_ids(
+        self,
+        query_embedding: List[float],
+        top_k: int = 5,
+        candidate_ids: Optional[List[int]] = None
+    ) -> List[Tuple[int, float]]:
+        """Return ``(trip_id, score)`` pairs for the ``top_k`` nearest trips, best first.
+
+        When ``candidate_ids`` is given, only those rows of the matrix are scored.
+        """
+        matrix, trip_ids = self._snapshot()
+        if candidate_ids is not None and len(trip_ids):
+            positions = np.flatnonzero(np.isin(trip_ids, np.asarray(candidate_ids, dtype=np.int64)))
+            matrix, trip_ids = matrix[positions], trip_ids[positions]
+        if top_k <= 0 or len(trip_ids) == 0:
+            return []
+
+        query = self._normalize(np.asarray(query_embedding, dtype=np.float32))
+        scores = matrix @ query
+
+        k = min(top_k, len(scores))
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(trip_ids[i]), float(scores[i])) for i in order]
+
+    def search(
+        self,
+        db: Session,
+        query_embedding: List[float],
+        top_k: int,
+        filters: Optional[models.TripSearchFilters] = None
+    ) -> List[Tuple[models.Trip, float]]:
+        self.ensure(db)
+        candidate_ids = None
+        clauses = trip_filter_clauses(filters)
+        if clauses:
+            candidate_ids = [trip_id for (trip_id,) in db.query(models.Trip.trip_id).filter(*clauses)]
+            if not candidate_ids:
+                return []
+
+        hits = self.search_ids(query_embedding, top_k, candidate_ids)
+        if not hits:
+            return []
+
+        trips = db.query(models.Trip).filter(models.Trip.trip_id.in_([trip_id for trip_id, _ in hits])).all()
+        trips_by_id = {trip.trip_id: trip for trip in trips}
+        return [(trips_by_id[trip_id], score) for trip_id, score in hits if trip_id in trips_by_id]
+
+
+class SqliteVecTripIndex:
+    """Trip embeddings kept in a sqlite-vec ``vec0`` table next to ``trips``; KNN runs inside SQLite."""
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self._loaded = False
+        for target in (engine, async_engine.sync_engine):
+            event.listen(target, "connect", lambda dbapi_conn, _record: load_sqlite_vec(dbapi_conn))
+
+    def build(self, db: Session):
+        """Create the vec0 table if needed and backfill trips that are missing from it."""
+        db.execute(text(trip_vec_table_ddl(self.dim)))
+        rows = db.execute(text(
+            f"SELECT trip_id, embedding FROM trips WHERE embedding IS NOT NULL "
+            f"AND trip_id NOT IN (SELECT trip_id FROM {TRIP_VEC_TABLE})"
+        )).all()
+        if rows:
+            self._insert(
+                db,
+                [trip_id for trip_id, _ in rows],
+                [embedding_service.deserialize_embedding(embedding) for _, embedding in rows]
+            )
+        db.commit()
+        self._loaded = True
+        print(f"sqlite-vec trip index ready ({len(rows)} trips backfilled)")
+
+    def ensure(self, db: Session):
+        if not self._loaded:
+            self.build(db)
+
+    def _insert(self, db: Session, trip_ids: List[int], embeddings):
+        # vec0 tables do not support upserts, so replace explicitly.
+        db.execute(
+            text(f"DELETE FROM {TRIP_VEC_TABLE} WHERE trip_id = :trip_id"),
+            [{"trip_id": trip_id} for trip_id in trip_ids]
+        )
+        db.execute(
+            text(f"INSERT INTO {TRIP_VEC_TABLE} (trip_id, embedding) VALUES (:trip_id, :embedding)"),
+            [
+                {"trip_id": trip_id, "embedding": pack_query_vector(embedding)}
+                for trip_id, embedding in zip(trip_ids, embeddings)
+            ]
+        )
+
+    def add_many(self, db: Session, trip_ids: List[int], embeddings: List[List[float]]):
+        if not trip_ids:
+            return
+        self.ensure(db)
+        self._insert(db, trip_ids, embeddings)
+        db.commit()
+
+    def search(
+        self,
+        db: Session,
+        query_embedding: List[float],
+        top_k: int,
+        filters: Optional[models.TripSearchFilters] = None
+    ) -> List[Tuple[models.Trip, float]]:
+        self.ensure(db)
+        if top_k <= 0:
+            return []
+
+        clauses = trip_filter_clauses(filters)
+        if clauses:
+            return self._filtered_search(db, query_embedding, top_k, clauses)
+
+        stmt = text(f"""
+            SELECT trips.*, 1 - knn.distance AS score
+            FROM (
+                SELECT trip_id, distance FROM {TRIP_VEC_TABLE}
+                WHERE embedding MATCH :query AND k = :k
+            ) AS knn
+            JOIN trips ON trips.trip_id = knn.trip_id
+            ORDER BY knn.distance
+        """)
+        rows = db.execute(
+            select(models.Trip, column("score", Float)).from_statement(stmt),
+            {"query": pack_query_vector(query_embedding), "k": top_k}
+        ).all()
+        return [(trip, score) for trip, score in rows]
+
+    def _filtered_search(self, db: Session, query_embedding, top_k: int, clauses: list) -> List[Tuple[models.Trip, float]]:
+        """Apply the predicates first, then rank only the surviving rows with vec_distance_cosine."""
+        vec = table(TRIP_VEC_TABLE, column("trip_id"), column("embedding"))
+        score = (1 - func.vec_distance_cosine(vec.c.embedding, bindparam("query"))).label("score")
+        stmt = (
+            select(models.Trip, score)
+            .join(vec, vec.c.trip_id == models.Trip.trip_id)
+            .where(and_(*clauses))
+            .order_by(score.desc())
+            .limit(top_k)
+        )
+        rows = db.execute(stmt, {"query": pack_query_vector(query_embedding)}).all()
+        return [(trip, float(score)) for trip, score in rows]
+
+
 class VectorSearchService:
-    def cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        vec1_arr = np.array(vec1)
-        vec2_arr = np.array(vec2)
-        dot_product = np.dot(vec1_arr, vec2_arr)
-        norm1 = np.linalg.norm(vec1_arr)
-        norm2 = np.linalg.norm(vec2_arr)
-        return dot_product / (norm1 * norm2) if norm1 > 0 and norm2 > 0 else 0.0
-    
+    """Semantic trip search. ``VECTOR_SEARCH_BACKEND`` selects ``memory`` (default) or ``sqlite-vec``."""
+
+    def __init__(self, backend: Optional[str] = None):
+        self.backend = (backend or os.getenv("VECTOR_SEARCH_BACKEND", "memory")).lower()
+        if self.backend == "sqlite-vec":
+            self.index = SqliteVecTripIndex()
+        elif self.backend == "memory":
+            self.index = MemoryTripIndex()
+        else:
+            raise ValueError(f"Unknown VECTOR_SEARCH_BACKEND: {self.backend}")
+
+    def build_index(self, db: Session):
+        self.index.build(db)
+
+    def add_trip(self, db: Session, trip_id: int, embedding: List[float]):
+        """Register a freshly committed trip with the active backend."""
+        self.index.add_many(db, [trip_id], [embedding])
+
+    def add_trips(self, db: Session, trip_ids: List[int], embeddings: List[List[float]]):
+        self.index.add_many(db, trip_ids, embeddings)
+
     def search_trips(
-        self, 
-        db: Session, 
-        query: str, 
-        top_k: int = 5
+        self,
+        db: Session,
+        query: str,
+        top_k: int = 5,
+        filters: Optional[models.TripSearchFilters] = None
     ) -> List[Tuple[models.Trip, float]]:
+        """Rank trips by similarity to ``query`` among those matching ``filters`` (if any)."""
         query_embedding = embedding_service.generate_embedding(query)
-        
-        trips = db.query(models.Trip).filter(models.Trip.embedding.isnot(None)).all()
-        
-        results = []
-        for trip in trips:
-            trip_embedding = embedding_service.deserialize_embedding(trip.embedding)
-            similarity = self.cosine_similarity(query_embedding, trip_embedding)
-            results.append((trip, similarity))
-        
-        results.sort(key=lambda x: x[1], reverse=True)
-        return results[:top_k]
+        return self.index.search(db, query_embedding, top_k, filters)
 
 vector_search_service = VectorSearchService()
+
+def _warm_vector_index():
+    db = SessionLocal()
+    try:
+        vector_search_service.index.ensure(db)
+    finally:
+        db.close()
+
+vector_index = LazyComponent("vector_index", _warm_vector_index)
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import time
+from typing import Optional
+from dotenv import load_dotenv
+from app.utils.http import get_http_client
+from app.utils.lazy import LazyComponent
+
+load_dotenv(override=True)
+
+HOSTS = {
+    "test": "https://test.api.amadeus.com",
+    "production": "https://api.amadeus.com",
+}
+
+class AmadeusError(Exception):
+    """Error response from the Amadeus API (mirrors the SDK's ResponseError fields we report)."""
+
+    def __init__(self, status_code: Optional[int], description: str, body=None):
+        super().__init__(f"[{status_code}] {description}")
+        self.status_code = status_code
+        self.description = description
+        self.body = body
+
+class AsyncAmadeusClient:
+    """Minimal async Amadeus REST client on the shared HTTP pool, with a cached OAuth token."""
+
+    def __init__(self, client_id: Optional[str] = None, client_secret: Optional[str] = None, hostname: Optional[str] = None):
+        self.client_id = client_id or os.getenv("AMADEUS_API_KEY")
+        self.client_secret = client_secret or os.getenv("AMADEUS_API_SECRET")
+        if not self.client_id or not self.client_secret:
+            raise ValueError("Missing required argument: AMADEUS_API_KEY / AMADEUS_API_SECRET")
+        self.base_url = HOSTS[hostname or os.getenv("AMADEUS_HOSTNAME", "test")]
+        self._token: Optional[str] = None
+        self._token_expires = 0.0
+        self._token_lock = asyncio.Lock()
+
+    async def _access_token(self) -> str:
+        async with self._token_lock:
+            # Refresh a little early so in-flight requests never carry an expired token.
+            if self._token is None or time.time() > self._token_expires - 30:
+                resp = await get_http_client().post(
+                    f"{self.base_url}/v1/security/oauth2/token",
+                    data={
+                        "grant_type": "client_credentials",
+                        "client_id": self.client_id,
+                        "client_secret": self.client_secret,
+                    },
+                )
+                if resp.status_code != 200:
+                    raise AmadeusError(resp.status_code, "Authentication failed", resp.text)
+                payload = resp.json()
+                self._token = payload["access_token"]
+                self._token_expires = time.time() + int(payload.get("expires_in", 1799))
+            return self._token
+
+    async def get(self, path: str, **params) -> list:
+        """GET an Amadeus endpoint and return its ``data`` list."""
+        token = await self._access_token()
+        resp = await get_http_client().get(
+            f"{self.base_url}{path}",
+            params=params,
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        body = resp.json() if resp.content else {}
+        if resp.status_code >= 400:
+            errors = body.get("errors", [{}]) if isinstance(body, dict) else [{}]
+            description = errors[0].get("detail") or errors[0].get("title") or resp.reason_phrase
+            raise AmadeusError(resp.status_code, description, body)
+        return body.get("data", [])
+
+    async def flight_offers(self, **params) -> list:
+        return await self.get("/v2/shopping/flight-offers", **params)
+
+    async def hotels_by_city(self, **params) -> list:
+        return await self.get("/v1/reference-data/locations/hotels/by-city", **params)
+
+    async def hotel_offers(self, **params) -> list:
+        return await self.get("/v3/shopping/hotel-offers", **params)
+
+_amadeus = LazyComponent("amadeus", AsyncAmadeusClient)
+
+def get_amadeus() -> AsyncAmadeusClient:
+    return _amadeus.get()
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Awaitable, Dict, Optional, TypeVar
+from fastapi import Request
+from langchain_core.callbacks import AsyncCallbackHandler
+
+T = TypeVar("T")
+
+DISCONNECT_POLL_INTERVAL = 0.5
+
+class ClientDisconnected(Exception):
+    """The client went away before the response was ready; its work was cancelled."""
+
+class AgentUsageTracker(AsyncCallbackHandler):
+    """Callback counting one agent run's LLM tokens and the tool calls still in flight."""
+
+    def __init__(self):
+        self.tokens = 0
+        self.open_tools = 0
+
+    async def on_llm_end(self, response, **kwargs):
+        counted = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    counted += usage.get("total_tokens", 0)
+        if not counted:
+            counted = (response.llm_output or {}).get("token_usage", {}).get("total_tokens", 0)
+        self.tokens += counted
+
+    async def on_tool_start(self, serialized, input_str, **kwargs):
+        self.open_tools += 1
+
+    async def on_tool_end(self, output, **kwargs):
+        self.open_tools -= 1
+
+    async def on_tool_error(self, error, **kwargs):
+        self.open_tools -= 1
+
+class CancellationStats:
+    """What client disconnects cut short, and an estimate of the LLM tokens that were not spent.
+
+    Savings per cancelled agent run are the agent's average tokens per completed run minus
+    what the run had already used.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.agent_runs = {}
+        self.tool_calls = 0
+        self.tokens_spent = 0
+        self.tokens_saved = 0
+        self._completed: Dict[str, list] = {}
+
+    def record_request(self, endpoint: str):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def record_completed(self, agent: str, tokens: int):
+        with self._lock:
+            totals = self._completed.setdefault(agent, [0, 0])
+            totals[0] += 1
+            totals[1] += tokens
+
+    def record_cancelled(self, agent: str, tracker: AgentUsageTracker):
+        with self._lock:
+            self.agent_runs[agent] = self.agent_runs.get(agent, 0) + 1
+            self.tool_calls += max(tracker.open_tools, 0)
+            self.tokens_spent += tracker.tokens
+            runs, tokens = self._completed.get(agent, (0, 0))
+            if runs:
+                self.tokens_saved += max(round(tokens / runs) - tracker.tokens, 0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "agent_runs": dict(self.agent_runs),
+                "tool_calls": self.tool_calls,
+                "tokens_spent_before_cancel": self.tokens_spent,
+                "tokens_saved_estimate": self.tokens_saved,
+            }
+
+cancellation_stats = CancellationStats()
+
+async def wait_for_disconnect(request: Request, interval: float = DISCONNECT_POLL_INTERVAL):
+    while not await request.is_disconnected():
+        await asyncio.sleep(interval)
+
+async def run_until_disconnect(request: Request, work: Awaitable[T], endpoint: str) -> T:
+    """Await ``work`` but cancel it, and raise ``ClientDisconnected``, if the client goes away first."""
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.create_task(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return task.result()
+        cancellation_stats.record_request(endpoint)
+        raise ClientDisconnected()
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+async def stream_until_disconnect(request: Request, events: AsyncIterator[Any], endpoint: str) -> AsyncIterator[Any]:
+    """Relay ``events`` to the client and cancel the producer the moment the client disconnects.
+
+    Each step of ``events`` runs as its own task, so a disconnect interrupts a long stage
+    instead of being noticed only at the next write.
+    """
+    watcher = asyncio.create_task(wait_for_disconnect(request))
+    step: Optional[asyncio.Future] = None
+    try:
+        while True:
+            step = asyncio.ensure_future(events.__anext__())
+            await asyncio.wait({step, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not step.done():
+                cancellation_stats.record_request(endpoint)
+                return
+            try:
+                item = step.result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        watcher.cancel()
+        if step is not None and not step.done():
+            step.cancel()
+            await asyncio.gather(step, return_exceptions=True)
+        await events.aclose()
@@ -0,0 +1,36 @@
+import os
+from typing import Optional
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+_client: Optional[httpx.AsyncClient] = None
+
+def http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", 3)),
+        read=float(os.getenv("HTTP_READ_TIMEOUT", 20)),
+        write=float(os.getenv("HTTP_WRITE_TIMEOUT", 5)),
+        pool=float(os.getenv("HTTP_POOL_TIMEOUT", 5)),
+    )
+
+def get_http_client() -> httpx.AsyncClient:
+    """Process-wide async HTTP client: pooled keep-alive connections and explicit timeouts."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=http_timeout(),
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", 100)),
+                max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", 20)),
+                keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30)),
+            ),
+        )
+    return _client
+
+async def close_http_client():
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
@@ -0,0 +1,78 @@
+import threading
+import time
+from typing import Callable, Dict, Generic, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+class LazyComponent(Generic[T]):
+    """Build an expensive singleton on first use (thread-safe) and record how long it took."""
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self.name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._instance: Optional[T] = None
+        self._ready = False
+        self.load_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        components[name] = self
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def get(self) -> T:
+        if self._ready:
+            return self._instance
+        with self._lock:
+            if not self._ready:
+                start = time.perf_counter()
+                try:
+                    self._instance = self._factory()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                finally:
+                    self.load_seconds = time.perf_counter() - start
+                self.error = None
+                self._ready = True
+                print(f"[startup] {self.name} ready in {self.load_seconds:.2f}s")
+        return self._instance
+
+    def status(self) -> dict:
+        return {
+            "warm": self._ready,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "error": self.error,
+        }
+
+
+components: Dict[str, LazyComponent] = {}
+phases: Dict[str, float] = {}
+
+
+def record_phase(name: str, seconds: float):
+    """Record a named startup phase (e.g. module import, lifespan warmup) for the timing report."""
+    phases[name] = round(seconds, 3)
+    print(f"[startup] {name}: {seconds:.2f}s")
+
+
+def warmup(names: Optional[List[str]] = None) -> dict:
+    """Eagerly build the named components (all by default); failures are recorded, not raised."""
+    for name in names or list(components):
+        if name not in components:
+            print(f"[startup] unknown component {name!r}, skipping warmup")
+            continue
+        try:
+            components[name].get()
+        except Exception as e:
+            print(f"[startup] {name} failed to warm up: {e}")
+    return startup_report()
+
+
+def component_status() -> Dict[str, dict]:
+    return {name: component.status() for name, component in components.items()}
+
+
+def startup_report() -> dict:
+    return {"phases": dict(phases), "components": component_status()}
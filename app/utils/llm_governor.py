@@ -0,0 +1,349 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+# Statuses after which the provider asks us to slow down rather than reporting a bad request.
+THROTTLED_STATUSES = (429, 503)
+
+class TokenBucket:
+    """Per-minute budget that refills continuously. Reservations may drive the level negative,
+    which is what queues later callers behind earlier ones."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        self._refill(now)
+        if not self.rate or self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= amount
+
+    def give(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+class LLMGovernor:
+    """Process-wide pacing of OpenAI calls: requests-per-minute and tokens-per-minute budgets,
+    a bounded queue, a shared cool-down after provider throttling, and queue-wait metrics.
+
+    Time accounting is done under a thread lock, so sync and async callers share one budget;
+    only the waiting itself is done with ``time.sleep`` or ``asyncio.sleep``.
+    """
+
+    def __init__(
+        self,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_wait: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        completion_tokens: Optional[int] = None
+    ):
+        self.rpm = TokenBucket(rpm if rpm is not None else float(os.getenv("LLM_RPM", 500)))
+        self.tpm = TokenBucket(tpm if tpm is not None else float(os.getenv("LLM_TPM", 200000)))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv("LLM_MAX_QUEUE_WAIT", 30))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", 4))
+        # Completion tokens reserved up front when a request sets no max_tokens; corrected afterwards from the
+        # reported usage (the JSON body, or the final chunk of a stream sent with ``stream_usage``).
+        self.completion_tokens = completion_tokens if completion_tokens is not None else int(os.getenv("LLM_COMPLETION_ESTIMATE", 600))
+        self._lock = threading.Lock()
+        self._cooldown_until = 0.0
+        self.waiting = 0
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def estimate_tokens(self, request: httpx.Request) -> int:
+        """Prompt tokens approximated from the request body (~4 bytes per token) plus the completion budget."""
+        body = request.content or b""
+        completion = self.completion_tokens
+        try:
+            payload = json.loads(body)
+            completion = payload.get("max_tokens") or payload.get("max_completion_tokens") or completion
+        except (ValueError, AttributeError):
+            pass
+        return len(body) // 4 + completion
+
+    def reserve(self, tokens: int) -> Optional[float]:
+        """Reserve budget for one call and return how long to wait before sending it,
+        or None when that wait would exceed ``max_wait`` (nothing is reserved then)."""
+        with self._lock:
+            now = time.monotonic()
+            delay = max(self._cooldown_until - now, self.rpm.delay(1, now), self.tpm.delay(tokens, now))
+            if delay > self.max_wait:
+                self.rejected += 1
+                return None
+            self.rpm.take(1)
+            self.tpm.take(tokens)
+            self.requests += 1
+            self.waiting += 1
+            return delay
+
+    def waited(self, seconds: float):
+        with self._lock:
+            self.waiting -= 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def settle(self, reserved: int, used: int):
+        """Return (or charge) the difference between the reserved estimate and the reported usage."""
+        with self._lock:
+            self.tpm.give(reserved - used)
+
+    def cool_down(self, seconds: float, reserved: int, retrying: bool):
+        """Hold every caller back for ``seconds``: one throttled response means the budget is spent for all.
+
+        A throttled call used no tokens, so its reservation is returned before any retry reserves again.
+        """
+        with self._lock:
+            self.throttled += 1
+            if retrying:
+                self.retries += 1
+            self.tpm.give(reserved)
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + seconds)
+
+    def backoff(self, response: httpx.Response, attempt: int) -> float:
+        """``Retry-After`` (seconds, HTTP date or OpenAI's ``retry-after-ms``) if given, else exponential; both jittered."""
+        delay = None
+        retry_ms = response.headers.get("retry-after-ms")
+        retry_after = response.headers.get("retry-after")
+        try:
+            if retry_ms is not None:
+                delay = float(retry_ms) / 1000
+            elif retry_after is not None:
+                delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                delay = None
+        if delay is None:
+            delay = min(0.5 * 2 ** attempt, 20.0)
+        # Jitter keeps callers that were throttled together from retrying together.
+        return delay * random.uniform(1.0, 1.5)
+
+    def busy_response(self, request: httpx.Request) -> httpx.Response:
+        """Local 429 for calls that would queue longer than ``max_wait``; the SDK raises it as a RateLimitError."""
+        return httpx.Response(
+            429,
+            headers={"retry-after": str(int(self.max_wait))},
+            json={"error": {"message": "LLM request queue is full", "type": "requests", "code": "local_rate_limit"}},
+            request=request,
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            served = self.requests - self.waiting
+            return {
+                "requests": self.requests,
+                "waiting": self.waiting,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "rejected": self.rejected,
+                "queue_wait_avg_ms": round(self.wait_total / served * 1000, 1) if served else 0.0,
+                "queue_wait_max_ms": round(self.wait_max * 1000, 1),
+                "cooldown_s": round(max(self._cooldown_until - now, 0.0), 2),
+                "rpm_available": round(self.rpm.level, 1),
+                "tpm_available": round(self.tpm.level),
+            }
+
+llm_governor = LLMGovernor()
+
+def _usage_tokens(response: httpx.Response) -> Optional[int]:
+    try:
+        return response.json().get("usage", {}).get("total_tokens")
+    except (ValueError, AttributeError):
+        return None
+
+class _StreamUsage:
+    """Picks ``usage.total_tokens`` out of an SSE stream; with ``stream_usage`` it arrives in the last chunk."""
+
+    def __init__(self):
+        self._buffer = b""
+        self.tokens: Optional[int] = None
+
+    def feed(self, chunk: bytes):
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            # Earlier chunks carry "usage": null; only the final one has totals worth parsing.
+            if not line.startswith(b"data:") or b'"total_tokens"' not in line:
+                continue
+            try:
+                usage = json.loads(line[5:]).get("usage") or {}
+            except (ValueError, AttributeError):
+                continue
+            if usage.get("total_tokens") is not None:
+                self.tokens = usage["total_tokens"]
+
+class _SettlingAsyncStream(httpx.AsyncByteStream):
+    """Passes a streamed body through and settles the reservation when the stream is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, governor: "LLMGovernor", reserved: int):
+        self.stream = stream
+        self.governor = governor
+        self.reserved = reserved
+        self.usage = _StreamUsage()
+        self._settled = False
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self.usage.feed(chunk)
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            # A stream cut off before its usage chunk stays charged at the estimate.
+            if not self._settled and self.usage.tokens is not None:
+                self._settled = True
+                self.governor.settle(self.reserved, self.usage.tokens)
+
+class _SettlingStream(httpx.SyncByteStream):
+    """Blocking counterpart of ``_SettlingAsyncStream``."""
+
+    def __init__(self, stream: httpx.SyncByteStream, governor: "LLMGovernor", reserved: int):
+        self.stream = stream
+        self.governor = governor
+        self.reserved = reserved
+        self.usage = _StreamUsage()
+        self._settled = False
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.usage.feed(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            if not self._settled and self.usage.tokens is not None:
+                self._settled = True
+                self.governor.settle(self.reserved, self.usage.tokens)
+
+def _is_event_stream(response: httpx.Response) -> bool:
+    return response.headers.get("content-type", "").startswith("text/event-stream")
+
+def _is_json(response: httpx.Response) -> bool:
+    return response.headers.get("content-type", "").startswith("application/json")
+
+class GovernedAsyncTransport(httpx.AsyncBaseTransport):
+    """httpx transport that paces OpenAI requests through ``llm_governor`` and retries throttled ones."""
+
+    def __init__(self, governor: LLMGovernor = llm_governor, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.governor = governor
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        tokens = self.governor.estimate_tokens(request)
+        for attempt in range(self.governor.max_retries + 1):
+            delay = self.governor.reserve(tokens)
+            if delay is None:
+                return self.governor.busy_response(request)
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self.governor.waited(delay)
+            response = await self.transport.handle_async_request(request)
+            if response.status_code in THROTTLED_STATUSES:
+                retrying = attempt < self.governor.max_retries
+                self.governor.cool_down(self.governor.backoff(response, attempt), tokens, retrying)
+                if retrying:
+                    await response.aclose()
+                    continue
+            elif _is_event_stream(response):
+                return httpx.Response(
+                    response.status_code,
+                    headers=response.headers,
+                    stream=_SettlingAsyncStream(response.stream, self.governor, tokens),
+                    request=request,
+                    extensions=response.extensions,
+                )
+            elif _is_json(response):
+                await response.aread()
+                used = _usage_tokens(response)
+                if used is not None:
+                    self.governor.settle(tokens, used)
+            return response
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+class GovernedTransport(httpx.BaseTransport):
+    """Blocking counterpart of ``GovernedAsyncTransport`` for sync ``invoke`` calls."""
+
+    def __init__(self, governor: LLMGovernor = llm_governor, transport: Optional[httpx.BaseTransport] = None):
+        self.governor = governor
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        tokens = self.governor.estimate_tokens(request)
+        for attempt in range(self.governor.max_retries + 1):
+            delay = self.governor.reserve(tokens)
+            if delay is None:
+                return self.governor.busy_response(request)
+            try:
+                time.sleep(delay)
+            finally:
+                self.governor.waited(delay)
+            response = self.transport.handle_request(request)
+            if response.status_code in THROTTLED_STATUSES:
+                retrying = attempt < self.governor.max_retries
+                self.governor.cool_down(self.governor.backoff(response, attempt), tokens, retrying)
+                if retrying:
+                    response.close()
+                    continue
+            elif _is_event_stream(response):
+                return httpx.Response(
+                    response.status_code,
+                    headers=response.headers,
+                    stream=_SettlingStream(response.stream, self.governor, tokens),
+                    request=request,
+                    extensions=response.extensions,
+                )
+            elif _is_json(response):
+                response.read()
+                used = _usage_tokens(response)
+                if used is not None:
+                    self.governor.settle(tokens, used)
+            return response
+        return response
+
+    def close(self):
+        self.transport.close()
+
+def governed_openai_kwargs() -> dict:
+    """``ChatOpenAI`` arguments routing its HTTP traffic through the shared governor.
+
+    SDK retries are turned off: the governor retries throttled calls itself, after a shared
+    cool-down, instead of every caller retrying on its own schedule.
+    """
+    return {
+        "http_client": httpx.Client(transport=GovernedTransport()),
+        "http_async_client": httpx.AsyncClient(transport=GovernedAsyncTransport()),
+        "max_retries": 0,
+    }
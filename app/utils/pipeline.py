@@ -0,0 +1,156 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+class StageSkipped(Exception):
+    """Raised in place of a stage's result when one of its dependencies failed."""
+
+@dataclass
+class StageProgress:
+    """An intermediate event a running stage pushed onto the pipeline's progress queue."""
+    stage: str
+    event: Dict[str, Any]
+
+@dataclass
+class Stage:
+    """A unit of pipeline work. ``run`` receives the results of ``deps`` keyed by stage name."""
+    name: str
+    run: Callable[[Dict[str, Any]], Awaitable[Any]]
+    deps: Tuple[str, ...] = field(default_factory=tuple)
+    emit: bool = True
+
+def _validate(stages: List[Stage]):
+    names = {stage.name for stage in stages}
+    if len(names) != len(stages):
+        raise ValueError("Duplicate stage names in pipeline")
+    for stage in stages:
+        missing = set(stage.deps) - names
+        if missing:
+            raise ValueError(f"Stage {stage.name!r} depends on unknown stages: {sorted(missing)}")
+
+async def run_dag(stages: List[Stage], progress: Optional["asyncio.Queue[StageProgress]"] = None) -> AsyncIterator[Tuple[str, Any]]:
+    """Run stages as soon as their dependencies finish and yield ``(name, result)`` in completion order.
+
+    A failed stage yields its exception as the result; its dependents yield ``StageSkipped``.
+    Only stages with ``emit=True`` are yielded. If ``progress`` is given, ``StageProgress``
+    items stages put on it are yielded as ``(stage, StageProgress)`` while they run.
+    Closing the iterator early (e.g. when the client disconnects) cancels every stage still running.
+    """
+    _validate(stages)
+    waiting = {stage.name: stage for stage in stages}
+    results: Dict[str, Any] = {}
+    failed: set = set()
+    running: Dict[asyncio.Task, Stage] = {}
+
+    def start_ready() -> List[Tuple[str, Any]]:
+        skipped = []
+        changed = True
+        while changed:
+            changed = False
+            for name, stage in list(waiting.items()):
+                blocked = [dep for dep in stage.deps if dep in failed]
+                if blocked:
+                    del waiting[name]
+                    failed.add(name)
+                    skipped.append((stage, StageSkipped(f"Skipped because {', '.join(blocked)} failed")))
+                    changed = True
+                elif all(dep in results for dep in stage.deps):
+                    del waiting[name]
+                    inputs = {dep: results[dep] for dep in stage.deps}
+                    running[asyncio.create_task(stage.run(inputs), name=f"stage:{name}")] = stage
+        return [(stage.name, error) for stage, error in skipped if stage.emit]
+
+    def drain_progress():
+        while progress is not None and not progress.empty():
+            item = progress.get_nowait()
+            yield item.stage, item
+
+    progress_getter: Optional[asyncio.Task] = None
+    try:
+        for event in start_ready():
+            yield event
+        while running:
+            waiters = set(running)
+            if progress is not None:
+                if progress_getter is None:
+                    progress_getter = asyncio.create_task(progress.get())
+                waiters.add(progress_getter)
+            done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+
+            if progress_getter is not None and progress_getter in done:
+                item = progress_getter.result()
+                done.discard(progress_getter)
+                progress_getter = None
+                yield item.stage, item
+            for event in drain_progress():
+                yield event
+
+            finished = []
+            for task in done:
+                if task not in running:
+                    continue
+                stage = running.pop(task)
+                error = task.exception()
+                if error is not None:
+                    failed.add(stage.name)
+                    finished.append((stage, error))
+                else:
+                    results[stage.name] = task.result()
+                    finished.append((stage, results[stage.name]))
+            for stage, result in finished:
+                if stage.emit:
+                    yield stage.name, result
+            for event in start_ready():
+                yield event
+        for event in drain_progress():
+            yield event
+    finally:
+        if progress_getter is not None:
+            progress_getter.cancel()
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+_late_tasks: set = set()
+
+def _detach(task: asyncio.Task):
+    """Let a task that missed its deadline finish in the background without leaking its exception."""
+    _late_tasks.add(task)
+    def done(t: asyncio.Task):
+        _late_tasks.discard(t)
+        if not t.cancelled():
+            t.exception()
+    task.add_done_callback(done)
+
+async def gather_with_deadlines(calls: Dict[str, Awaitable], deadlines: Dict[str, float]) -> Tuple[Dict[str, Any], List[str]]:
+    """Run ``calls`` concurrently, each bounded by its own deadline in seconds from now.
+
+    Returns the results that arrived in time (a raised exception is returned as the result)
+    and the names that missed their deadline. Late calls are not cancelled: they keep running
+    in the background so their answers can still land in caches for the next request.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    pending = {name: asyncio.ensure_future(call) for name, call in calls.items()}
+    results: Dict[str, Any] = {}
+    missed: List[str] = []
+    try:
+        while pending:
+            now = loop.time()
+            for name in [name for name in pending if now - start >= deadlines[name]]:
+                missed.append(name)
+                _detach(pending.pop(name))
+            if not pending:
+                break
+            timeout = min(start + deadlines[name] for name in pending) - now
+            done, _ = await asyncio.wait(pending.values(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for name, task in list(pending.items()):
+                if task in done:
+                    del pending[name]
+                    results[name] = task.exception() or task.result()
+    except asyncio.CancelledError:
+        for task in pending.values():
+            task.cancel()
+        raise
+    return results, missed
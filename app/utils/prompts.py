@@ -1,30 +1,32 @@
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
-SQL_TOOL_DESCRIPTION = """Execute SQL queries on the trips database. Use this for specific criteria like budget, duration, activity level, country, number of people, or combinations. 
+SQL_TOOL_DESCRIPTION = """Execute one read-only SQLite SELECT on the trips database. Use this for specific criteria like budget, duration, activity level, city, number of people, or combinations.
 
-Available tables:
-- trips (trip_id, user_id, country, description, duration, num_people, activity_level, budget, embedding)
-- cities (city_id, name, country, lat, lon)
-- trip_cities (relation_id, trip_id, city_id)
+Schema (complete; do not guess other tables or columns):
+{schema}
+
+trips.cities is a comma-separated list of city names; trips.activity_level is 'low', 'medium' or 'high'.
+Results are capped at {max_rows} rows and queries at {timeout_ms} ms. Queries that scan large tables without using an index are refused.
 
 Examples:
-- Budget filter: SELECT * FROM trips WHERE budget <= 2000
-- Duration: SELECT * FROM trips WHERE duration BETWEEN 7 AND 10
-- Activity: SELECT * FROM trips WHERE activity_level = 'high'
-- Country: SELECT * FROM trips WHERE country LIKE '%Italy%'
-- Combined: SELECT * FROM trips WHERE budget < 2500 AND duration >= 7"""
+- Budget filter: SELECT title, budget FROM trips WHERE budget <= 2000
+- Duration: SELECT title, duration FROM trips WHERE duration BETWEEN 7 AND 10
+- Activity: SELECT title FROM trips WHERE activity_level = 'high'
+- City: SELECT title, cities FROM trips WHERE cities LIKE '%Rome%'
+- Combined: SELECT COUNT(*) FROM trips WHERE budget < 2500 AND duration >= 7"""
 
 TRAVEL_ASSISTANT_SYSTEM_MESSAGE = """You are a helpful travel assistant. You help users find their perfect trip.
 
 You have access to multiple tools:
 
-1. search_trips - Search existing trips by description/experience
-   - Use when: users want to see what trips are available
-   - Examples: "show me romantic trips", "find adventure vacations"
+1. search_trips - Search existing trips by description/experience, with optional filters
+   - Use when: users want to see what trips are available, including combined requests
+   - Filters: min_budget, max_budget, min_duration, max_duration, activity_level, num_people, cities
+   - Examples: "show me romantic trips", "romantic trips under $2000 for a week" → one call with query="romantic", max_budget=2000, min_duration=6, max_duration=8
 
 2. SQL database - Query existing trips by specific criteria
-   - Use when: users want to filter by budget, duration, country, activity level
-   - Examples: "trips under $2000", "7-10 day trips in Italy"
+   - Use when: users want purely structured answers (counts, averages, exact listings) with no descriptive preference
+   - Examples: "how many trips cost under $2000", "list all 7-10 day trips"
 
 3. search_transport - Find transport options (flights, trains, cars)
    - Use when: users need transport information or pricing
@@ -42,7 +44,7 @@ You have access to multiple tools:
     - Returns: Detailed structured trip plan with daily itinerary
 
 Strategy:
-- "Show me trips to X" → search_trips or SQL (existing trips)
+- "Show me trips to X" → search_trips with cities="X" (add filters instead of a separate SQL call)
 - "Find flights/transport..." → search_transport
 - "Find hotels..." → search_hotels
 - "Plan a trip to X" → First search_transport, then search_hotels, then format_trip_summary
@@ -172,6 +174,13 @@ Rules:
 Format as a simple list with brief, clear warnings. Never mention APIs or data sources.
 """
 
+HISTORY_SUMMARY_PROMPT = """
+You maintain a running summary of a conversation between a user and a travel assistant.
+Update the current summary with the new messages. Keep every fact later answers may need:
+destinations, dates, budget, group size, preferences, constraints, and the choices already made.
+Drop greetings and repetition. Write at most a short paragraph of plain sentences, no lists.
+"""
+
 def get_chat_prompts() -> ChatPromptTemplate:
     return {
         "chat": ChatPromptTemplate.from_messages([
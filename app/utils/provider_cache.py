@@ -0,0 +1,180 @@
+import asyncio
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from dotenv import load_dotenv
+from app.utils.cache import LRUCache
+
+load_dotenv(override=True)
+
+# (fresh seconds, extra seconds a stale value may still be served while it is refreshed)
+DEFAULT_PROVIDER_TTLS = {
+    "flights": (10 * 60, 10 * 60),
+    "transit": (30 * 60, 30 * 60),
+    "car_routes": (60 * 60, 60 * 60),
+    "hotel_offers": (10 * 60, 5 * 60),
+}
+
+schema = """
+CREATE TABLE IF NOT EXISTS provider_cache (
+    cache_key TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    value TEXT NOT NULL,
+    stored_at REAL NOT NULL
+);
+"""
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in sorted(value.items())}
+    return value
+
+def make_key(provider: str, args: tuple, kwargs: dict) -> str:
+    return json.dumps([provider, _normalize(list(args)), _normalize(kwargs)], sort_keys=True, default=str)
+
+def is_error_result(result: Any) -> bool:
+    return isinstance(result, dict) and "error" in result
+
+def is_cacheable(result: Any) -> bool:
+    """Errors are never cached, and neither are empty answers: they are as likely a provider hiccup as a fact."""
+    return not is_error_result(result) and result not in (None, [], {})
+
+class ProviderCache:
+    """Two-tier cache for async provider calls with per-provider TTLs and stale-while-revalidate.
+
+    The in-process LRU is always on; a SQLite tier shared across workers and restarts is
+    enabled by ``PROVIDER_CACHE_PATH`` and is only touched from worker threads, never the
+    event loop. Concurrent misses on one key share a single provider call. Error and empty
+    results are never cached.
+    """
+
+    def __init__(self, max_size: Optional[int] = None, path: Optional[str] = None):
+        self.memory = LRUCache(max_size=max_size if max_size is not None else int(os.getenv("PROVIDER_CACHE_SIZE", 1024)))
+        self.path = path if path is not None else os.getenv("PROVIDER_CACHE_PATH", "")
+        self.ttls: Dict[str, Tuple[float, float]] = {}
+        for provider, (ttl, stale) in DEFAULT_PROVIDER_TTLS.items():
+            self.ttls[provider] = (
+                float(os.getenv(f"PROVIDER_CACHE_TTL_{provider.upper()}", ttl)),
+                float(os.getenv(f"PROVIDER_CACHE_STALE_{provider.upper()}", stale)),
+            )
+        self._local = threading.local()
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._fills: Dict[str, asyncio.Future] = {}
+        self._tasks = set()
+        self.coalesced = 0
+        self.stale_served = 0
+        self.refreshes = 0
+
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(schema)
+            self._local.conn = conn
+        return conn
+
+    def _read_persistent(self, key: str) -> Optional[Tuple[float, Any]]:
+        row = self._conn().execute("SELECT value, stored_at FROM provider_cache WHERE cache_key = ?", (key,)).fetchone()
+        return None if row is None else (row[1], json.loads(row[0]))
+
+    def _write_persistent(self, provider: str, key: str, result: Any, stored_at: float):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO provider_cache (cache_key, provider, value, stored_at) VALUES (?, ?, ?, ?)",
+            (key, provider, json.dumps(result, default=str), stored_at)
+        )
+        conn.commit()
+
+    async def _read(self, provider: str, key: str) -> Optional[Tuple[float, Any]]:
+        entry = self.memory.get(key)
+        if entry is not None or not self.path:
+            return entry
+        entry = await asyncio.to_thread(self._read_persistent, key)
+        if entry is None:
+            return None
+        ttl, stale = self.ttls[provider]
+        remaining = entry[0] + ttl + stale - time.time()
+        if remaining <= 0:
+            return None
+        self.memory.set(key, entry, ttl=remaining)
+        return entry
+
+    async def _write(self, provider: str, key: str, result: Any):
+        ttl, stale = self.ttls[provider]
+        stored_at = time.time()
+        self.memory.set(key, (stored_at, result), ttl=ttl + stale)
+        if self.path:
+            await asyncio.to_thread(self._write_persistent, provider, key, result, stored_at)
+
+    async def _refresh(self, provider: str, key: str, func: Callable, args: tuple, kwargs: dict):
+        try:
+            result = await func(*args, **kwargs)
+            if is_cacheable(result):
+                await self._write(provider, key, result)
+                self.refreshes += 1
+        except Exception as e:
+            print(f"[Warning] Background refresh of {provider} failed: {e}")
+        finally:
+            with self._refresh_lock:
+                self._refreshing.discard(key)
+
+    async def _fill(self, provider: str, key: str, func: Callable, args: tuple, kwargs: dict) -> Any:
+        result = await func(*args, **kwargs)
+        if is_cacheable(result):
+            await self._write(provider, key, result)
+        return result
+
+    async def call(self, provider: str, func: Callable, *args, **kwargs) -> Any:
+        """Await ``func`` through the cache; stale hits are returned at once and refreshed as event-loop tasks."""
+        key = make_key(provider, args, kwargs)
+        entry = await self._read(provider, key)
+        if entry is not None:
+            stored_at, result = entry
+            if time.time() - stored_at < self.ttls[provider][0]:
+                return result
+            self.stale_served += 1
+            with self._refresh_lock:
+                start_refresh = key not in self._refreshing
+                self._refreshing.add(key)
+            if start_refresh:
+                task = asyncio.create_task(self._refresh(provider, key, func, args, kwargs))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return result
+
+        # The chat agent, the transport agent and retries often miss on the same key at once.
+        pending = self._fills.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+        future = asyncio.ensure_future(self._fill(provider, key, func, args, kwargs))
+        self._fills[key] = future
+        future.add_done_callback(lambda _: self._fills.pop(key, None))
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        return {**self.memory.stats(), "coalesced": self.coalesced, "stale_served": self.stale_served, "refreshes": self.refreshes, "persistent": bool(self.path)}
+
+provider_cache = ProviderCache()
+
+def cached_provider(provider: str):
+    """Decorator routing an async provider call through ``provider_cache`` under ``provider``'s TTLs."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await provider_cache.call(provider, func, *args, **kwargs)
+        wrapper.uncached = func
+        return wrapper
+    return decorator
@@ -1,36 +1,316 @@
+import asyncio
+import os
+import sqlite3
+import threading
 import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+import tiktoken
+from dotenv import load_dotenv
+from app.utils.cache import LRUCache
+from app.utils.lazy import LazyComponent
 
-session_memory = {}
+load_dotenv(override=True)
 
-def cleanup_sessions():
-    while True:
-        now = time.time()
-        expired = [
-            sid for sid, data in session_memory.items()
-            if now - data["last_used"] > 3600
+# Tokens of conversation each agent sees (summary included); the planner needs the last plan, tips and risks little.
+DEFAULT_HISTORY_BUDGETS = {
+    "chat": 4000,
+    "planner": 3000,
+    "tips": 1000,
+    "risks": 1000,
+}
+# Once the unsummarized tail grows past this, its oldest turns are folded into the running summary.
+HISTORY_RECENT_TOKENS = int(os.getenv("HISTORY_RECENT_TOKENS", 4000))
+# Per-message overhead of the chat format (role markers and separators).
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SESSION_TTL = float(os.getenv("SESSION_TTL", 3600))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", 200))
+SESSION_COMPACT_INTERVAL = float(os.getenv("SESSION_COMPACT_INTERVAL", 600))
+
+_summary_tasks = set()
+_summarizing = set()
+
+class ApproximateEncoding:
+    """Stand-in for a tiktoken encoding when it cannot be loaded: one token per 4 characters."""
+
+    def encode(self, text: str) -> List[str]:
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    def decode(self, tokens: List[str]) -> str:
+        return "".join(tokens)
+
+def _load_encoding():
+    # tiktoken downloads the encoding on first use; without egress, budgets fall back to an estimate
+    # instead of failing a request whose LLM work is already done.
+    name = os.getenv("HISTORY_TOKEN_ENCODING", "o200k_base")
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        print(f"[Warning] Token encoding {name} unavailable ({e}); estimating 4 characters per token")
+        return ApproximateEncoding()
+
+_encoding = LazyComponent("token_encoding", _load_encoding)
+
+def _get_encoding():
+    return _encoding.get()
+
+def count_tokens(text: str) -> int:
+    return len(_get_encoding().encode(text or "")) + MESSAGE_OVERHEAD_TOKENS
+
+def history_budget(stage: str) -> int:
+    default = DEFAULT_HISTORY_BUDGETS.get(stage, int(os.getenv("HISTORY_TOKEN_BUDGET", 2000)))
+    return int(os.getenv(f"HISTORY_TOKEN_BUDGET_{stage.upper()}", default))
+
+# A loaded session is a dict with "messages" (each {seq, role, content, tokens}, oldest first),
+# "summary", "summary_tokens" and "summarized_seq" (seq of the last message folded into the summary).
+
+class MemorySessionStore:
+    """Sessions in this process only: LRU-bounded, expiring ``ttl`` seconds after the last write,
+    each capped to its newest ``max_messages`` messages."""
+
+    def __init__(self, max_sessions: Optional[int] = None, ttl: float = SESSION_TTL, max_messages: int = SESSION_MAX_MESSAGES):
+        max_sessions = max_sessions if max_sessions is not None else int(os.getenv("SESSION_MAX_SESSIONS", 10000))
+        self.sessions = LRUCache(max_size=max_sessions, ttl=ttl)
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return None
+            return {**session, "messages": list(session["messages"])}
+
+    def append(self, session_id: str, messages: List[Tuple[str, str]]):
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = {
+                    "messages": deque(maxlen=self.max_messages),
+                    "summary": "",
+                    "summary_tokens": 0,
+                    "summarized_seq": 0,
+                    "next_seq": 1,
+                }
+            for role, content in messages:
+                session["messages"].append({"seq": session["next_seq"], "role": role, "content": content, "tokens": count_tokens(content)})
+                session["next_seq"] += 1
+            # Re-setting refreshes both the LRU position and the TTL.
+            self.sessions.set(session_id, session)
+
+    def set_summary(self, session_id: str, summary: str, summarized_seq: int, expected_seq: int) -> bool:
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None or session["summarized_seq"] != expected_seq:
+                return False
+            session.update(summary=summary, summary_tokens=count_tokens(summary), summarized_seq=summarized_seq)
+            return True
+
+    def compact(self) -> int:
+        return self.sessions.purge_expired()
+
+    def stats(self) -> dict:
+        return {"backend": "memory", **self.sessions.stats()}
+
+schema = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    last_used REAL NOT NULL,
+    summary TEXT NOT NULL DEFAULT '',
+    summary_tokens INTEGER NOT NULL DEFAULT 0,
+    summarized_seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_last_used ON sessions (last_used);
+CREATE TABLE IF NOT EXISTS session_messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    tokens INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_session_messages_session ON session_messages (session_id, seq);
+"""
+
+class SqliteSessionStore:
+    """Sessions in a SQLite file in WAL mode, so every worker sees the same history."""
+
+    def __init__(self, path: Optional[str] = None, ttl: float = SESSION_TTL, max_messages: int = SESSION_MAX_MESSAGES):
+        self.path = path or os.getenv("SESSION_STORE_PATH", "./db/sessions.db")
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(schema)
+            self._local.conn = conn
+        return conn
+
+    def load(self, session_id: str) -> Optional[dict]:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT summary, summary_tokens, summarized_seq FROM sessions WHERE session_id = ? AND last_used > ?",
+            (session_id, time.time() - self.ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        messages = [
+            {"seq": seq, "role": role, "content": content, "tokens": tokens}
+            for seq, role, content, tokens in conn.execute(
+                "SELECT seq, role, content, tokens FROM session_messages WHERE session_id = ? ORDER BY seq", (session_id,)
+            )
         ]
-        for sid in expired:
-            del session_memory[sid]
-        time.sleep(600)
-
-def update_session(session_id, role, content):
-    now = time.time()
-    if not session_memory.get(session_id):
-        session_memory[session_id] = {
-            "last_used": now,
-            "history": [{
-                "role": role,
-                "content": content
-            }]
-        }
-    else:
-        session_memory[session_id]["last_used"] = now
-        session_memory[session_id]["history"].append({
-            "role": role,
-            "content": content
-        })
-
-def get_history(session_id):
-    if not session_memory.get(session_id):
+        return {"messages": messages, "summary": row[0], "summary_tokens": row[1], "summarized_seq": row[2]}
+
+    def append(self, session_id: str, messages: List[Tuple[str, str]]):
+        rows = [(session_id, role, content, count_tokens(content)) for role, content in messages]
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO sessions (session_id, last_used) VALUES (?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_used = excluded.last_used",
+                (session_id, time.time())
+            )
+            conn.executemany("INSERT INTO session_messages (session_id, role, content, tokens) VALUES (?, ?, ?, ?)", rows)
+            conn.execute(
+                "DELETE FROM session_messages WHERE session_id = ? AND seq <= "
+                "(SELECT seq FROM session_messages WHERE session_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                (session_id, session_id, self.max_messages)
+            )
+
+    def set_summary(self, session_id: str, summary: str, summarized_seq: int, expected_seq: int) -> bool:
+        conn = self._conn()
+        with conn:
+            # Conditional on the old boundary, so two workers summarizing at once cannot interleave.
+            updated = conn.execute(
+                "UPDATE sessions SET summary = ?, summary_tokens = ?, summarized_seq = ? WHERE session_id = ? AND summarized_seq = ?",
+                (summary, count_tokens(summary), summarized_seq, session_id, expected_seq)
+            ).rowcount
+        return updated > 0
+
+    def compact(self) -> int:
+        cutoff = time.time() - self.ttl
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "DELETE FROM session_messages WHERE session_id IN (SELECT session_id FROM sessions WHERE last_used <= ?)", (cutoff,)
+            )
+            removed = conn.execute("DELETE FROM sessions WHERE last_used <= ?", (cutoff,)).rowcount
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return removed
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        sessions, = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()
+        messages, = conn.execute("SELECT COUNT(*) FROM session_messages").fetchone()
+        return {"backend": "sqlite", "path": self.path, "sessions": sessions, "messages": messages}
+
+def make_session_store(backend: Optional[str] = None):
+    backend = (backend or os.getenv("SESSION_STORE", "memory")).lower()
+    if backend == "sqlite":
+        return SqliteSessionStore()
+    if backend == "memory":
+        return MemorySessionStore()
+    raise ValueError(f"Unknown SESSION_STORE: {backend}")
+
+session_store = make_session_store()
+
+def append_turn(session_id: str, user_message: str, assistant_message: str):
+    """Record one exchange with a single store write."""
+    session_store.append(session_id, [("user", user_message), ("assistant", assistant_message)])
+
+def get_history(session_id) -> List[Dict]:
+    session = session_store.load(session_id)
+    if not session:
+        return []
+    return [{"role": message["role"], "content": message["content"]} for message in session["messages"]]
+
+def _context(session: Optional[dict], stage: str) -> List[Dict]:
+    if not session:
         return []
-    return session_memory[session_id]["history"]
\ No newline at end of file
+    budget = history_budget(stage)
+    context = []
+    used = 0
+    if session["summary"]:
+        context.append({"role": "system", "content": f"Summary of the earlier conversation: {session['summary']}"})
+        used += session["summary_tokens"]
+
+    recent = []
+    for message in reversed(session["messages"]):
+        if message["seq"] <= session["summarized_seq"]:
+            break
+        if used + message["tokens"] > budget:
+            if not recent:
+                allowed = max(budget - used - MESSAGE_OVERHEAD_TOKENS, 0)
+                encoding = _get_encoding()
+                recent.append({"role": message["role"], "content": encoding.decode(encoding.encode(message["content"] or "")[:allowed])})
+            break
+        recent.append({"role": message["role"], "content": message["content"]})
+        used += message["tokens"]
+    return context + list(reversed(recent))
+
+def get_context(session_id, stage: str) -> List[Dict]:
+    """History for one agent: the running summary plus the newest turns that fit ``stage``'s token budget.
+
+    If even the newest message alone is over budget it is cut down rather than dropped.
+    """
+    return _context(session_store.load(session_id), stage)
+
+def get_contexts(session_id, stages: Iterable[str]) -> Dict[str, List[Dict]]:
+    """``get_context`` for several agents from a single store read."""
+    session = session_store.load(session_id)
+    return {stage: _context(session, stage) for stage in stages}
+
+async def refresh_summary(session_id, summarize: Callable[[str, List[Dict]], Awaitable[str]]):
+    """Fold the oldest unsummarized turns into the running summary once the tail exceeds ``HISTORY_RECENT_TOKENS``.
+
+    Only the newly folded messages and the previous summary are sent to ``summarize``, and the
+    tail is cut to half the limit so the summary is refreshed every few turns rather than every turn.
+    """
+    if session_id in _summarizing:
+        return
+    _summarizing.add(session_id)
+    try:
+        session = await asyncio.to_thread(session_store.load, session_id)
+        if not session:
+            return
+        tail = [message for message in session["messages"] if message["seq"] > session["summarized_seq"]]
+        pending = sum(message["tokens"] for message in tail)
+        if pending <= HISTORY_RECENT_TOKENS:
+            return
+
+        folded = []
+        while len(folded) < len(tail) - 1 and pending > HISTORY_RECENT_TOKENS // 2:
+            folded.append(tail[len(folded)])
+            pending -= folded[-1]["tokens"]
+        if not folded:
+            return
+
+        summary = await summarize(session["summary"], [{"role": m["role"], "content": m["content"]} for m in folded])
+        await asyncio.to_thread(session_store.set_summary, session_id, summary, folded[-1]["seq"], session["summarized_seq"])
+    except Exception as e:
+        print(f"[Warning] History summary for session {session_id} failed: {e}")
+    finally:
+        _summarizing.discard(session_id)
+
+def schedule_summary(session_id, summarize: Callable[[str, List[Dict]], Awaitable[str]]):
+    """Refresh the session summary in the background so no request waits for it."""
+    task = asyncio.create_task(refresh_summary(session_id, summarize))
+    _summary_tasks.add(task)
+    task.add_done_callback(_summary_tasks.discard)
+
+async def compact_sessions_periodically(interval: float = SESSION_COMPACT_INTERVAL):
+    """Background task started from the app lifespan: drop expired sessions every ``interval`` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await asyncio.to_thread(session_store.compact)
+            if removed:
+                print(f"Session compaction removed {removed} expired sessions")
+        except Exception as e:
+            print(f"[Warning] Session compaction failed: {e}")
@@ -0,0 +1,165 @@
+import os
+import re
+import sqlite3
+import time
+from typing import List, Optional, Tuple
+from dotenv import load_dotenv
+from app.database import DATABASE_PATH
+
+load_dotenv(override=True)
+
+# Tables the chat agent may read; everything else in the file (sessions, hotel cache, ...) is hidden.
+SQL_TOOL_TABLES = ("trips", "cities")
+# Columns that are useless to the agent and expensive to return.
+HIDDEN_COLUMNS = {("trips", "embedding")}
+
+SQL_TIMEOUT_MS = int(os.getenv("SQL_TOOL_TIMEOUT_MS", 2000))
+SQL_MAX_ROWS = int(os.getenv("SQL_TOOL_MAX_ROWS", 50))
+# Worst-case rows visited by unindexed scans (product over nested scans) before a plan is refused.
+SQL_MAX_SCAN_ROWS = int(os.getenv("SQL_TOOL_MAX_SCAN_ROWS", 200000))
+# SQLite VM instructions between progress-handler checks of the deadline.
+PROGRESS_STEPS = 10000
+
+_FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+# "FROM trips t" / "JOIN cities AS c": newer SQLite reports scans by alias.
+_TABLE_ALIAS = re.compile(r'\b(?:FROM|JOIN)\s+"?(\w+)"?(?:\s+(?:AS\s+)?(?!(?:WHERE|JOIN|ON|LEFT|INNER|CROSS|GROUP|ORDER|LIMIT|USING|NATURAL)\b)(\w+))?', re.IGNORECASE)
+
+class SQLGuardError(Exception):
+    """The query was refused or cut off; the message is returned to the agent so it can rewrite it."""
+
+class GuardedSQLDatabase:
+    """Read-only access to the trips database for the chat agent.
+
+    Each query runs on its own read-only connection with an authorizer limited to
+    ``SQL_TOOL_TABLES``, a progress-handler deadline and a row cap. Plans that would
+    scan large tables without an index are refused before execution.
+    """
+
+    def __init__(
+        self,
+        path: str = DATABASE_PATH,
+        timeout_ms: int = SQL_TIMEOUT_MS,
+        max_rows: int = SQL_MAX_ROWS,
+        max_scan_rows: int = SQL_MAX_SCAN_ROWS
+    ):
+        self.path = path
+        self.timeout_ms = timeout_ms
+        self.max_rows = max_rows
+        self.max_scan_rows = max_scan_rows
+        self._schema: Optional[str] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only=ON")
+        conn.execute("PRAGMA busy_timeout=1000")
+        return conn
+
+    def _authorize(self, action, arg1, arg2, db_name, trigger):
+        if action in (sqlite3.SQLITE_SELECT, sqlite3.SQLITE_FUNCTION):
+            return sqlite3.SQLITE_OK
+        if action == sqlite3.SQLITE_READ:
+            if arg1 not in SQL_TOOL_TABLES:
+                return sqlite3.SQLITE_DENY
+            # Reading a hidden column yields NULL instead of failing the whole query.
+            return sqlite3.SQLITE_IGNORE if (arg1, arg2) in HIDDEN_COLUMNS else sqlite3.SQLITE_OK
+        return sqlite3.SQLITE_DENY
+
+    def _row_estimate(self, conn: sqlite3.Connection, table: str) -> int:
+        # MAX(rowid) is a single index seek and a close upper bound for append-mostly tables.
+        try:
+            return conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{table}"').fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def check_plan(self, conn: sqlite3.Connection, query: str):
+        """Refuse queries whose unindexed scans would visit more than ``max_scan_rows`` rows."""
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+        scanned = [match.group(1) for *_, detail in plan if (match := _FULL_SCAN.match(detail))]
+        if not scanned:
+            return
+        sizes = {table: self._row_estimate(conn, table) for table in SQL_TOOL_TABLES}
+        for table, alias in _TABLE_ALIAS.findall(query):
+            if alias and table in sizes:
+                sizes.setdefault(alias, sizes[table])
+        cost = 1
+        for table in scanned:
+            # CTE and subquery names are not tables; assume the largest table.
+            cost *= max(sizes.get(table, max(sizes.values())), 1)
+        if cost > self.max_scan_rows:
+            raise SQLGuardError(
+                f"query plan scans {', '.join(scanned)} without an index (~{cost:,} rows); "
+                "filter on an indexed column or add a tighter WHERE clause"
+            )
+
+    def run(self, query: str) -> Tuple[List[str], List[tuple], bool]:
+        """Execute one SELECT; returns column names, at most ``max_rows`` rows, and whether rows were cut."""
+        query = query.strip().rstrip(";")
+        conn = self._connect()
+        try:
+            conn.set_authorizer(self._authorize)
+            try:
+                self.check_plan(conn, query)
+            except sqlite3.DatabaseError as e:
+                raise SQLGuardError(str(e))
+
+            deadline = time.monotonic() + self.timeout_ms / 1000
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_STEPS)
+            try:
+                cursor = conn.execute(query)
+                rows = cursor.fetchmany(self.max_rows + 1)
+            except sqlite3.OperationalError as e:
+                if time.monotonic() > deadline:
+                    raise SQLGuardError(f"query exceeded {self.timeout_ms} ms and was interrupted")
+                raise SQLGuardError(str(e))
+            except sqlite3.Error as e:
+                raise SQLGuardError(str(e))
+            columns = [column[0] for column in cursor.description or ()]
+            return columns, rows[:self.max_rows], len(rows) > self.max_rows
+        finally:
+            conn.close()
+
+    def query(self, query: str) -> str:
+        """``run`` formatted for the agent; refusals come back as text so it can rewrite the query."""
+        try:
+            columns, rows, truncated = self.run(query)
+        except SQLGuardError as e:
+            return f"Error: {e}"
+        if not rows:
+            return "No rows."
+        lines = [" | ".join(columns)]
+        lines += [" | ".join("" if value is None else str(value) for value in row) for row in rows]
+        if truncated:
+            lines.append(f"(first {self.max_rows} rows only; use COUNT(*) or a narrower WHERE clause for the rest)")
+        return "\n".join(lines)
+
+    def schema(self) -> str:
+        """Compact schema of the readable tables with their indexes, built once per process."""
+        if self._schema is not None:
+            return self._schema
+        conn = self._connect()
+        try:
+            lines = []
+            for table in SQL_TOOL_TABLES:
+                columns = [
+                    f"{name} {col_type or 'ANY'}"
+                    for _, name, col_type, *_ in conn.execute(f'PRAGMA table_info("{table}")')
+                    if (table, name) not in HIDDEN_COLUMNS
+                ]
+                if not columns:
+                    continue
+                indexed = sorted({
+                    column
+                    for index in conn.execute(f'PRAGMA index_list("{table}")')
+                    for *_, column in conn.execute(f'PRAGMA index_info("{index[1]}")')
+                    if column
+                })
+                line = f"- {table}({', '.join(columns)})"
+                if indexed:
+                    line += f" indexed: {', '.join(indexed)}"
+                lines.append(line)
+            self._schema = "\n".join(lines)
+        finally:
+            conn.close()
+        return self._schema
+
+guarded_sql_db = GuardedSQLDatabase()
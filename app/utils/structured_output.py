@@ -0,0 +1,191 @@
+import copy
+import json
+import re
+from typing import Any, List, Optional, Type, TypeVar
+from pydantic import BaseModel, ValidationError
+
+M = TypeVar("M", bound=BaseModel)
+
+def strict_json_schema(model: Type[BaseModel]) -> dict:
+    """OpenAI ``response_format`` for ``model`` in strict mode.
+
+    Strict schemas must list every property as required and forbid extra keys; optional
+    fields stay optional because pydantic already types them as ``anyOf [..., null]``.
+    """
+    schema = copy.deepcopy(model.model_json_schema())
+
+    def tighten(node):
+        if isinstance(node, dict):
+            node.pop("default", None)
+            if node.get("type") == "object" and "properties" in node:
+                node["required"] = list(node["properties"])
+                node["additionalProperties"] = False
+            for value in node.values():
+                tighten(value)
+        elif isinstance(node, list):
+            for value in node:
+                tighten(value)
+
+    tighten(schema)
+    return {"type": "json_schema", "json_schema": {"name": model.__name__, "schema": schema, "strict": True}}
+
+_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*\n?|\n?\s*```\s*$")
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+# A key at the end of an object, optionally followed by a colon and a bare (non-string) value.
+_DANGLING_PAIR = re.compile(r'[{,]\s*("(?:[^"\\]|\\.)*"\s*(?::\s*([-+\w.]*))?)$')
+_DANGLING_LITERAL = re.compile(r"[\[,]\s*([-+\w.]+)$")
+
+def _is_complete_value(value: Optional[str]) -> bool:
+    if value is None:
+        return False
+    try:
+        json.loads(value)
+        return True
+    except json.JSONDecodeError:
+        return False
+
+def repair_json(text: str) -> str:
+    """Fix the near-misses LLMs produce: code fences, prose around the object,
+    trailing commas, and output truncated mid-string or mid-array."""
+    text = _FENCE.sub("", text.strip())
+    start = text.find("{")
+    if start == -1:
+        return text
+    text = text[start:]
+
+    stack: List[str] = []
+    in_string = escaped = False
+    end = None
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+            if not stack:
+                end = i + 1
+                break
+
+    if end is not None:
+        return _TRAILING_COMMA.sub(r"\1", text[:end])
+
+    # Truncated: close the open string, drop a dangling key or half-written literal, then close every bracket.
+    if in_string:
+        text = (text[:-1] if escaped else text) + '"'
+    text = text.rstrip()
+    if stack and stack[-1] == "}":
+        key_pair = _DANGLING_PAIR.search(text)
+        if key_pair and not _is_complete_value(key_pair.group(2)):
+            text = text[:key_pair.start(1)]
+    else:
+        literal = _DANGLING_LITERAL.search(text)
+        if literal and not _is_complete_value(literal.group(1)):
+            text = text[:literal.start(1)]
+    text = re.sub(r"[,:]\s*$", "", text.rstrip())
+    text += "".join(reversed(stack))
+    return _TRAILING_COMMA.sub(r"\1", text)
+
+def _drop_truncated_item(data: Any, error: ValidationError) -> bool:
+    """Remove the last element of a list when it is what failed validation (a cut-off final item)."""
+    for detail in error.errors():
+        loc = detail["loc"]
+        for i, part in enumerate(loc):
+            if not isinstance(part, int):
+                continue
+            container = data
+            try:
+                for step in loc[:i]:
+                    container = container[step]
+            except (KeyError, IndexError, TypeError):
+                break
+            if isinstance(container, list) and part == len(container) - 1:
+                container.pop()
+                return True
+            break
+    return False
+
+def parse_model(text: str, model: Type[M]) -> Optional[M]:
+    """Validate ``text`` as ``model``, falling back to ``repair_json``; None if neither works.
+
+    A repaired document whose last list item was cut off mid-way loses that item.
+    """
+    try:
+        return model.model_validate_json(text)
+    except ValidationError:
+        pass
+    try:
+        data = json.loads(repair_json(text))
+    except json.JSONDecodeError:
+        return None
+    while True:
+        try:
+            return model.model_validate(data)
+        except ValidationError as e:
+            if not _drop_truncated_item(data, e):
+                return None
+
+class JsonArrayStreamer:
+    """Incrementally scan a JSON object as it streams in and return each element of the
+    top-level array ``key`` as soon as its closing bracket arrives."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._pending_key: Optional[str] = None
+        self._array_depth: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._done = False
+
+    def feed(self, chunk: str) -> List[Any]:
+        items = []
+        self._buffer += chunk
+        while self._pos < len(self._buffer) and not self._done:
+            char = self._buffer[self._pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = self._buffer[self._string_start:self._pos]
+            elif char == '"':
+                self._in_string = True
+                self._string_start = self._pos + 1
+            elif char == ":":
+                # Only keys of the outermost object can name the array we want.
+                self._pending_key = self._last_string if self._depth == 1 else None
+            elif char in "{[":
+                self._depth += 1
+                if char == "[" and self._array_depth is None and self._pending_key == self.key:
+                    self._array_depth = self._depth
+                elif self._array_depth is not None and self._depth == self._array_depth + 1:
+                    self._item_start = self._pos
+            elif char in "}]":
+                if self._array_depth is not None and self._depth == self._array_depth + 1 and self._item_start is not None:
+                    try:
+                        items.append(json.loads(self._buffer[self._item_start:self._pos + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self._item_start = None
+                elif self._array_depth is not None and self._depth == self._array_depth:
+                    self._done = True
+                self._depth -= 1
+            elif char == "," and self._depth == 1:
+                self._pending_key = None
+            self._pos += 1
+        return items
@@ -1,67 +1,93 @@
 from langchain.tools import tool
-from langchain_community.utilities import SQLDatabase
-from langchain_community.agent_toolkits import SQLDatabaseToolkit
-from langchain_openai import ChatOpenAI
 from app.services.vector_search_service import vector_search_service
+from app.services.hotel_directory import hotel_directory
 from app.database import SessionLocal
-from app.models import TripPlan
-import requests
+from app.models import TripPlan, TripSearchFilters
+from app.utils.provider_cache import cached_provider
+from app.utils.pipeline import gather_with_deadlines
+from app.utils.http import get_http_client
+from app.utils.amadeus_client import AmadeusError, get_amadeus
+from app.utils.sql_tool import guarded_sql_db
+import asyncio
 import os
 import time
 import json
 from datetime import datetime
+from typing import Optional
 from dotenv import load_dotenv
-from tavily import TavilyClient
+from tavily import AsyncTavilyClient
 
 
 load_dotenv(override=True)
 
 @tool
-def search_trips(query: str, top_k: int = 3) -> str:
-    """Search existing trips in database based on description/experience. Use when users want to see what trips are available (not when planning a new trip)."""
+def search_trips(
+    query: str,
+    top_k: int = 3,
+    min_budget: Optional[float] = None,
+    max_budget: Optional[float] = None,
+    min_duration: Optional[int] = None,
+    max_duration: Optional[int] = None,
+    activity_level: Optional[str] = None,
+    num_people: Optional[int] = None,
+    cities: Optional[str] = None
+) -> str:
+    """Search existing trips in database based on description/experience, optionally filtered by structured criteria. Use when users want to see what trips are available (not when planning a new trip).
+
+    Args:
+        query: Description of the desired experience (e.g. "romantic", "beach holiday")
+        top_k: Number of trips to return
+        min_budget: Minimum trip budget in USD
+        max_budget: Maximum trip budget in USD
+        min_duration: Minimum duration in days
+        max_duration: Maximum duration in days
+        activity_level: 'low', 'medium' or 'high'
+        num_people: Number of travellers the trip is designed for
+        cities: Comma-separated city names; matches trips visiting any of them
+    """
+    filters = TripSearchFilters(
+        min_budget=min_budget,
+        max_budget=max_budget,
+        min_duration=min_duration,
+        max_duration=max_duration,
+        activity_level=activity_level,
+        num_people=num_people,
+        cities=cities.split(",") if cities else None
+    )
     db = SessionLocal()
     try:
-        results = vector_search_service.search_trips(db, query, top_k)
+        results = vector_search_service.search_trips(db, query, top_k, None if filters.is_empty() else filters)
         
         if not results:
             return "No trips found matching your criteria."
         
         response = f"Found {len(results)} matching trips:\n\n"
         for i, (trip, score) in enumerate(results, 1):
-            cities = trip.cities
             response += f"{i}. {trip.title} (Match: {score:.0%})\n"
             response += f"   {trip.description}\n"
-            response += f"   Duration: {trip.duration} days | Activity: {trip.activity_level} | Budget: ${trip.budget}\n"
-            response += f"   Cities: {', '.join(cities)}\n\n"
+            response += f"   Duration: {trip.duration} days | Activity: {trip.activity_level} | Budget: ${trip.budget} | People: {trip.num_people}\n"
+            response += f"   Cities: {trip.cities}\n\n"
         
         return response
     finally:
         db.close()
 
+@tool
+def sql_db_query(query: str) -> str:
+    """Execute a read-only SQL query on the trips database."""
+    return guarded_sql_db.query(query)
+
 def get_sql_tool():
-    """Get SQL database tool for querying trip database."""
+    """Get the guarded SQL tool, with the live schema embedded in its description."""
     from app.utils.prompts import SQL_TOOL_DESCRIPTION
-    
-    db = SQLDatabase.from_uri("sqlite:///./db/roamly.db")
-    
-    api_key = os.getenv("OPENAI_API_KEY")
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, api_key=api_key)
-    
-    toolkit = SQLDatabaseToolkit(db=db, llm=llm)
-    sql_tools = toolkit.get_tools()
-    
-    for tool in sql_tools:
-        if tool.name == "sql_db_query":
-            tool.description = SQL_TOOL_DESCRIPTION
-    
-    return [t for t in sql_tools if t.name in ["sql_db_query", "sql_db_schema", "sql_db_list_tables"]]
 
-from amadeus import Client, ResponseError
-
-amadeus = Client(
-    client_id=os.getenv("AMADEUS_API_KEY"),
-    client_secret=os.getenv("AMADEUS_API_SECRET")
-)
+    # The schema is in the description, so the agent no longer spends turns listing tables.
+    sql_db_query.description = SQL_TOOL_DESCRIPTION.format(
+        schema=guarded_sql_db.schema(),
+        max_rows=guarded_sql_db.max_rows,
+        timeout_ms=guarded_sql_db.timeout_ms
+    )
+    return [sql_db_query]
 
 def normalize_flight(offer):
     itinerary = offer["itineraries"][0]
@@ -86,8 +112,17 @@ def normalize_flight(offer):
         }
     }
 
+# Seconds each provider may take before search_transport answers without it.
+DEFAULT_TRANSPORT_DEADLINES = {"plane": 8.0, "transit": 6.0, "car": 6.0}
+
+def transport_deadlines() -> dict:
+    return {
+        kind: float(os.getenv(f"TRANSPORT_DEADLINE_{kind.upper()}", os.getenv("TRANSPORT_DEADLINE", deadline)))
+        for kind, deadline in DEFAULT_TRANSPORT_DEADLINES.items()
+    }
+
 @tool
-def search_transport(origin: str, destination: str, date: str, passengers: int=1, pref_type: str = "") -> str:
+async def search_transport(origin: str, destination: str, date: str, passengers: int=1, pref_type: str = "") -> str:
     """Search for transport options (flights, trains, cars) and return best options.
     
     Args:
@@ -108,34 +143,38 @@ def search_transport(origin: str, destination: str, date: str, passengers: int=1
     print(f"  pref_type: {pref_type}")
     print(f"{'='*80}\n")
     
-    options = []
+    # The destination is where the hotel search will go next; warm its hotel list meanwhile.
+    hotel_directory.prefetch(destination)
+
+    labels = {"plane": "Flights", "transit": "Transit", "car": "Cars"}
+    deadlines = transport_deadlines()
+    calls = {
+        "plane": lambda: get_flights(origin, destination, date, passengers),
+        "transit": lambda: get_transit(origin, destination, date, passengers),
+        "car": lambda: get_car_routes(origin, destination, passengers=passengers),
+    }
+    options_by_kind = {}
     errors = []
 
-    if not pref_type or pref_type == "plane":
-        flights = get_flights(origin, destination, date, passengers)
-        
-        if flights and not isinstance(flights, dict):
-            options.extend(flights)
-        elif isinstance(flights, dict) and "error" in flights:
-            errors.append(f"Flights: {flights['error']}")
-        
-    if not options or not pref_type or pref_type == "transit":
-        transit_result = get_transit(origin, destination, date, passengers)
-        
-        if isinstance(transit_result, dict) and "error" in transit_result:
-            errors.append(f"Transit: {transit_result['error']}")
-        else:
-            for train in transit_result:
-                options.append(train)
+    async def query(kinds):
+        results, missed = await gather_with_deadlines({kind: calls[kind]() for kind in kinds}, deadlines)
+        for kind in kinds:
+            result = results.get(kind)
+            if kind in missed:
+                errors.append(f"{labels[kind]}: no response within {deadlines[kind]:g}s")
+            elif isinstance(result, Exception):
+                errors.append(f"{labels[kind]}: {result}")
+            elif isinstance(result, dict) and "error" in result:
+                errors.append(f"{labels[kind]}: {result['error']}")
+            elif result:
+                options_by_kind[kind] = list(result)
 
-    if not options or not pref_type or pref_type == "car":
-        cars = get_car_routes(origin, destination, date, passengers)
-        
-        if isinstance(cars, dict) and "error" in cars:
-            errors.append(f"Cars: {cars['error']}")
-        else:
-            for car in cars:
-                options.append(car)
+    # A preferred type is asked alone; the others are only queried, concurrently, if it has nothing.
+    if pref_type in labels:
+        await query([pref_type])
+    if not options_by_kind:
+        await query([kind for kind in labels if kind != pref_type])
+    options = [option for kind_options in options_by_kind.values() for option in kind_options]
     
     top_k = select_top_transport(options)
     
@@ -145,31 +184,38 @@ def search_transport(origin: str, destination: str, date: str, passengers: int=1
     
     return top_k
 
-def get_flights(origin: str, destination: str, date: str, passengers: int):
+@cached_provider("flights")
+async def get_flights(origin: str, destination: str, date: str, passengers: int):
     """Find flight offers between two cities on a given date."""
     try:
-        resp = amadeus.shopping.flight_offers_search.get(
+        offers = await get_amadeus().flight_offers(
             originLocationCode=origin,
             destinationLocationCode=destination,
             departureDate=date,
             adults=passengers,
             max=5
         )
-        results = [normalize_flight(offer) for offer in resp.data]
+        results = [normalize_flight(offer) for offer in offers]
         return results
-    except ResponseError as e:
+    except AmadeusError as e:
         return {"error": str(e)}
     except Exception as e:
         return {"error": str(e)}
 
-    async def _arun(self, *args, **kwargs):
-        raise NotImplementedError
+def google_error(resp) -> dict:
+    """``{"error": ...}`` for a non-2xx Google Routes reply, so it is reported and never cached as "no routes"."""
+    try:
+        message = resp.json().get("error", {}).get("message") or resp.text
+    except ValueError:
+        message = resp.text
+    return {"error": f"Google Routes returned {resp.status_code}: {message[:200]}"}
 
 def estimate_co2(self, distance_km: float, passengers: int) -> float:
     factor = 0.1
     return round(distance_km * factor * passengers, 2)
 
-def get_transit(origin, destination, date, passengers):
+@cached_provider("transit")
+async def get_transit(origin, destination, date, passengers):
     """Get transit options using Google Routes API v2."""
     print(f"\n{'='*80}")
     print(f"GET_TRANSIT CALLED")
@@ -224,11 +270,13 @@ def get_transit(origin, destination, date, passengers):
         print(f"  URL: {url}")
         print(f"  Departure time (RFC3339): {departure_time_rfc3339}")
         
-        resp = requests.post(url, headers=headers, json=body)
-        data = resp.json()
-        
+        resp = await get_http_client().post(url, headers=headers, json=body)
         print(f"\nAPI Response:")
         print(f"  Status code: {resp.status_code}")
+        if resp.is_error:
+            return google_error(resp)
+        data = resp.json()
+
         print(f"  Response data:")
         import json as json_lib
         print(json_lib.dumps(data, indent=2, ensure_ascii=False))
@@ -325,10 +373,8 @@ def get_transit(origin, destination, date, passengers):
         print(f"{'='*80}\n")
         return {"error": str(e)}
 
-    async def _arun(self, *args, **kwargs):
-        raise NotImplementedError
-
-def get_car_routes(origin: str, destination: str, fuel_type: str = "gasoline",
+@cached_provider("car_routes")
+async def get_car_routes(origin: str, destination: str, fuel_type: str = "gasoline",
              consumption_l_per_100km: float = 7.0, fuel_price_per_l: float = 1.8,
              passengers: int = 1, seats: int = 4):
     """Find driving routes, cost, and CO2 estimates using Google Maps Routes API."""
@@ -344,7 +390,9 @@ def get_car_routes(origin: str, destination: str, fuel_type: str = "gasoline",
             "routingPreference": "TRAFFIC_AWARE"
         }
         
-        resp = requests.post(url, headers=headers, json=body)
+        resp = await get_http_client().post(url, headers=headers, json=body)
+        if resp.is_error:
+            return google_error(resp)
         data = resp.json()
 
         routes = []
@@ -384,9 +432,6 @@ def get_car_routes(origin: str, destination: str, fuel_type: str = "gasoline",
     except Exception as e:
         return {"error": str(e)}
 
-    async def _arun(self, *args, **kwargs):
-        raise NotImplementedError
-
 def select_top_transport(options: list):
     """Select cheapest and most eco-friendly from transport options."""
     if not options:
@@ -404,8 +449,29 @@ def select_top_transport(options: list):
         "eco": eco,
     }
 
+@cached_provider("hotel_offers")
+async def get_hotel_offers(**api_params) -> list:
+    return await get_amadeus().hotel_offers(**api_params)
+
+HOTEL_OFFERS_MAX_IDS = int(os.getenv("HOTEL_OFFERS_MAX_IDS", 60))
+HOTEL_OFFERS_CHUNK_SIZE = int(os.getenv("HOTEL_OFFERS_CHUNK_SIZE", 20))
+
+async def get_hotel_offers_chunked(hotel_ids: list, **api_params) -> list:
+    """Price hotels in concurrent ID chunks; chunks that fail are dropped unless all of them do."""
+    chunks = [hotel_ids[i:i + HOTEL_OFFERS_CHUNK_SIZE] for i in range(0, len(hotel_ids), HOTEL_OFFERS_CHUNK_SIZE)]
+    results = await asyncio.gather(
+        *(get_hotel_offers(hotelIds=",".join(chunk), **api_params) for chunk in chunks),
+        return_exceptions=True
+    )
+    offers = [offer for result in results if not isinstance(result, Exception) for offer in result]
+    if not offers:
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise errors[0]
+    return offers
+
 @tool
-def search_hotels(city_code: str, check_in_date: str, check_out_date: str, adults: int = 2, room_quantity: int = 1, children: int = 0) -> str:
+async def search_hotels(city_code: str, check_in_date: str, check_out_date: str, adults: int = 2, room_quantity: int = 1, children: int = 0) -> str:
     """Search for hotels in a city using Amadeus API. Use when users need accommodation information.
     
     Args:
@@ -417,20 +483,14 @@ def search_hotels(city_code: str, check_in_date: str, check_out_date: str, adult
         children: Number of child guests (default: 0)
     """
     try:
-        # First, get hotel IDs in the city using hotel list API
-        hotel_list_response = amadeus.reference_data.locations.hotels.by_city.get(
-            cityCode=city_code
-        )
+        # Hotel IDs come from the local directory; only a city's first search hits the list API
+        hotel_ids = await hotel_directory.hotel_ids(city_code)
         
-        if not hotel_list_response.data:
+        if not hotel_ids:
             return f"No hotels found in {city_code}."
         
-        # Get hotel IDs (limit to first 50 for offer search)
-        hotel_ids = [hotel['hotelId'] for hotel in hotel_list_response.data[:50]]
-        
         # Build API parameters
         api_params = {
-            'hotelIds': ','.join(hotel_ids),
             'checkInDate': check_in_date,
             'checkOutDate': check_out_date,
             'adults': adults,
@@ -442,9 +502,7 @@ def search_hotels(city_code: str, check_in_date: str, check_out_date: str, adult
             api_params['children'] = children
         
         # Now search for offers using hotel IDs
-        response = amadeus.shopping.hotel_offers_search.get(**api_params)
-        
-        hotels = response.data[:10]
+        hotels = (await get_hotel_offers_chunked(hotel_ids[:HOTEL_OFFERS_MAX_IDS], **api_params))[:10]
         
         if not hotels:
             return f"No hotel offers found in {city_code} for {check_in_date} to {check_out_date}."
@@ -525,18 +583,27 @@ def search_hotels(city_code: str, check_in_date: str, check_out_date: str, adult
         
         return output
     
-    except ResponseError as e:
-        error_details = f"Amadeus API Error: {e.response.status_code}\n"
+    except AmadeusError as e:
+        error_details = f"Amadeus API Error: {e.status_code}\n"
         error_details += f"Description: {e.description}\n"
-        if hasattr(e, 'response') and hasattr(e.response, 'body'):
-            error_details += f"Details: {e.response.body}"
+        if e.body:
+            error_details += f"Details: {e.body}"
         return f"Error searching hotels: {error_details}"
     except Exception as e:
         return f"Error: {str(e)}"
     
 
+_tavily_client: Optional[AsyncTavilyClient] = None
+
+def get_tavily_client(api_key: str) -> AsyncTavilyClient:
+    """Reuse one Tavily client instead of building a new one per search."""
+    global _tavily_client
+    if _tavily_client is None:
+        _tavily_client = AsyncTavilyClient(api_key=api_key)
+    return _tavily_client
+
 @tool
-def web_search(query: str) -> str:
+async def web_search(query: str) -> str:
     """Search the web for information using the Tavily API.
     
     Args:
@@ -546,7 +613,6 @@ def web_search(query: str) -> str:
     if not tavily_api_key:
         return "Error: TAVILY_API_KEY not configured"
     
-    tavily_client = TavilyClient(api_key=tavily_api_key)
-    results = tavily_client.search(query, max_results=5)
+    results = await get_tavily_client(tavily_api_key).search(query, max_results=5)
     summary = "\n".join([r["title"] + ": " + r["url"] for r in results["results"]])
     return f"Search results for '{query}':\n{summary}"
\ No newline at end of file
@@ -0,0 +1,54 @@
+import csv
+import json
+from itertools import islice
+from typing import IO, Iterator, List, Optional, Tuple, Union
+from pydantic import ValidationError
+from app.models import TripCreate
+
+TRIP_FIELDS = list(TripCreate.model_fields)
+
+def detect_format(filename: Optional[str], fmt: Optional[str] = None) -> str:
+    """Resolve the import format from an explicit value or the file extension."""
+    fmt = (fmt or "").lower() or (filename or "").rsplit(".", 1)[-1].lower()
+    if fmt in ("jsonl", "ndjson", "json"):
+        return "jsonl"
+    if fmt == "csv":
+        return "csv"
+    raise ValueError(f"Unsupported trip import format: {fmt or filename!r} (expected csv or jsonl)")
+
+def iter_trip_records(stream: IO[str], fmt: str) -> Iterator[Union[dict, json.JSONDecodeError]]:
+    """Yield raw trip dicts one at a time from a text stream, without reading it fully.
+
+    A malformed JSONL line yields its ``JSONDecodeError`` in place of a record, so one bad
+    line is reported against its line number instead of aborting the import.
+    """
+    if fmt == "csv":
+        for row in csv.DictReader(stream):
+            yield {key: (value if value != "" else None) for key, value in row.items() if key in TRIP_FIELDS}
+    else:
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield e
+
+def iter_trip_chunks(stream: IO[str], fmt: str, chunk_size: int = 500) -> Iterator[Tuple[List[TripCreate], List[str]]]:
+    """Yield ``(valid_trips, errors)`` per chunk of ``chunk_size`` input records."""
+    records = enumerate(iter_trip_records(stream, fmt), 1)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        trips, errors = [], []
+        for line_no, record in chunk:
+            if isinstance(record, json.JSONDecodeError):
+                errors.append(f"Record {line_no}: invalid JSON ({record.msg})")
+                continue
+            try:
+                trips.append(TripCreate.model_validate(record))
+            except ValidationError as e:
+                errors.append(f"Record {line_no}: {e.errors()[0]['msg']}")
+        yield trips, errors
@@ -1,9 +1,20 @@
+import argparse
+import json
 import sqlite3
+import statistics
+import threading
+import time
 from pathlib import Path
-from app.services.embedding_service import embedding_service
+from app.database import DATABASE_PATH, apply_sqlite_pragmas
+from app.services.embedding_service import embedding_service, EMBEDDING_HEADER
+from app.utils.trip_import import detect_format, iter_trip_chunks
+from app.services.vector_search_service import (
+    vector_search_service, load_sqlite_vec, trip_vec_table_ddl, pack_query_vector, TRIP_VEC_TABLE
+)
 
-DB_PATH = Path(__file__).resolve().parent / "roamly.db"
-DB_PATH.parent.mkdir(exist_ok=True)
+# Same file the server opens, so DATABASE_PATH overrides apply to setup and imports too.
+DB_PATH = Path(DATABASE_PATH).resolve()
+DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
 schema = """
 CREATE TABLE IF NOT EXISTS trips (
@@ -19,6 +30,45 @@ CREATE TABLE IF NOT EXISTS trips (
     lng REAL,
     embedding BLOB
 );
+-- Columns the chat agent's SQL tool and search_trips filter on.
+CREATE INDEX IF NOT EXISTS ix_trips_budget ON trips (budget);
+CREATE INDEX IF NOT EXISTS ix_trips_duration ON trips (duration);
+CREATE INDEX IF NOT EXISTS ix_trips_activity_level ON trips (activity_level);
+CREATE INDEX IF NOT EXISTS ix_trips_num_people ON trips (num_people);
+-- city_id is worldcities' own id, so re-importing the same file updates rows instead of duplicating them.
+CREATE TABLE IF NOT EXISTS cities (
+    city_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_ascii TEXT,
+    country TEXT,
+    iso2 TEXT,
+    admin_name TEXT,
+    lat REAL,
+    lon REAL,
+    population INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_cities_name ON cities (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS ix_cities_country ON cities (country);
+CREATE INDEX IF NOT EXISTS ix_cities_population ON cities (population DESC);
+-- Bumped by every city import; running servers compare it to rebuild their suggestion index.
+CREATE TABLE IF NOT EXISTS cities_import (
+    import_id INTEGER PRIMARY KEY CHECK (import_id = 1),
+    imported_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hotel_directory (
+    city_code TEXT NOT NULL,
+    hotel_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT,
+    lat REAL,
+    lng REAL,
+    PRIMARY KEY (city_code, hotel_id)
+);
+CREATE TABLE IF NOT EXISTS hotel_directory_refresh (
+    city_code TEXT PRIMARY KEY,
+    refreshed_at REAL NOT NULL,
+    hotel_count INTEGER NOT NULL
+);
 """
 
 dummy_trips = [
@@ -34,8 +84,20 @@ dummy_trips = [
     ('Thai Island Hopping', 'Island-hopping and street food tour in Bangkok.', 11, 2, 'medium', 1600, 'Bangkok, Phuket, Chiang Mai', 13.7563, 100.5018, None)
 ]
 
+def drop_legacy_cities(conn):
+    """Drop a ``cities`` table not keyed by worldcities' id: the old pandas dump (no population) or
+    the name/country/lat/lon-keyed version. Either is re-imported from the CSV."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(cities)")}
+    indexes = {row[1] for row in conn.execute("PRAGMA index_list(cities)")}
+    if columns and ("population" not in columns or "ux_cities_identity" in indexes):
+        conn.execute("DROP TABLE cities")
+        print("Dropped legacy cities table; re-run import-cities to reload it.")
+
 def init_db():
     conn = sqlite3.connect(DB_PATH)
+    # journal_mode=WAL is stored in the database file, so every later connection inherits it.
+    apply_sqlite_pragmas(conn)
+    drop_legacy_cities(conn)
     cur = conn.cursor()
     cur.executescript(schema)
     conn.commit()
@@ -44,48 +106,241 @@ def init_db():
 
 import pandas as pd
 
-def import_cities(csv_path="worldcities.csv"):
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_csv(csv_path)
+def _city_row(record):
+    """(city_id, name, name_ascii, country, iso2, admin_name, lat, lon, population) from a worldcities.csv record."""
+    def text(key):
+        value = str(record.get(key, "") or "").strip()
+        return value or None
 
-    df = df.rename(columns={
-        "city": "name",
-        "country": "country",
-        "lat": "lat",
-        "lng": "lon"
-    })
+    def number(key, cast):
+        try:
+            return cast(float(record.get(key) or ""))
+        except ValueError:
+            return None
 
-    df[["name", "country", "lat", "lon"]].to_sql(
-        "cities", conn, if_exists="append", index=False
+    return (
+        number("id", int), text("city"), text("city_ascii"), text("country"), text("iso2"), text("admin_name"),
+        number("lat", float), number("lng", float), number("population", int)
     )
 
+def import_cities(csv_path="worldcities.csv", chunk_size=5000):
+    """Upsert cities from a worldcities.csv file, one transaction per chunk; safe to re-run."""
+    init_db()
+    conn = sqlite3.connect(DB_PATH)
+    apply_sqlite_pragmas(conn)
+    cur = conn.cursor()
+
+    imported = skipped = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size, dtype=str, keep_default_na=False):
+        rows = [_city_row(record) for record in chunk.to_dict("records")]
+        valid = [row for row in rows if row[0] is not None and row[1] and row[6] is not None and row[7] is not None]
+        skipped += len(rows) - len(valid)
+        cur.executemany("""
+            INSERT INTO cities (city_id, name, name_ascii, country, iso2, admin_name, lat, lon, population)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (city_id) DO UPDATE SET
+                name = excluded.name,
+                name_ascii = excluded.name_ascii,
+                country = excluded.country,
+                iso2 = excluded.iso2,
+                admin_name = excluded.admin_name,
+                lat = excluded.lat,
+                lon = excluded.lon,
+                population = excluded.population
+        """, valid)
+        conn.commit()
+        imported += len(valid)
+        print(f"  ✓ Imported {imported} cities...")
+
+    cur.execute("INSERT OR REPLACE INTO cities_import (import_id, imported_at) VALUES (1, ?)", (time.time(),))
+    conn.commit()
+    total = cur.execute("SELECT COUNT(*) FROM cities").fetchone()[0]
     conn.close()
-    print(f"Imported {len(df)} cities into database.")
+    print(f"City import complete: {imported} rows upserted, {skipped} skipped, {total} cities in database.")
 
-def insert_dummies():
+def connect():
+    """Open the database, with sqlite-vec loaded and its trip table present when that backend is active."""
     conn = sqlite3.connect(DB_PATH)
+    apply_sqlite_pragmas(conn)
+    if vector_search_service.backend == "sqlite-vec":
+        load_sqlite_vec(conn)
+        conn.execute(trip_vec_table_ddl())
+    return conn
+
+def insert_dummies():
+    conn = connect()
     cur = conn.cursor()
 
     print("Generating embeddings for trips (description only)...")
-    for trip_data in dummy_trips:
+    embeddings = embedding_service.generate_embeddings([trip_data[1] for trip_data in dummy_trips])
+    for trip_data, embedding in zip(dummy_trips, embeddings):
         title, description, duration, num_people, activity_level, budget, cities, lat, lng, _ = trip_data
         
-        embedding = embedding_service.generate_embedding(description)
-        embedding_json = embedding_service.serialize_embedding(embedding)
+        embedding_blob = embedding_service.serialize_embedding(embedding)
         
         cur.execute("""
             INSERT INTO trips (title, description, duration, num_people, activity_level, budget, cities, lat, lng, embedding)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (title, description, duration, num_people, activity_level, budget, cities, lat, lng, embedding_json))
+        """, (title, description, duration, num_people, activity_level, budget, cities, lat, lng, embedding_blob))
 
         trip_id = cur.lastrowid
+        if vector_search_service.backend == "sqlite-vec":
+            cur.execute(
+                f"INSERT INTO {TRIP_VEC_TABLE} (trip_id, embedding) VALUES (?, ?)",
+                (trip_id, pack_query_vector(embedding))
+            )
         print(f"  ✓ Trip {trip_id}: {title} - {description[:50]}...")
 
     conn.commit()
     conn.close()
     print(f"Successfully inserted {len(dummy_trips)} trips with embeddings!")
 
+def import_trips(path, fmt=None, chunk_size=500, batch_size=64):
+    """Stream trips from a CSV/JSONL file; each chunk is embedded in batches and written in one transaction."""
+    path = Path(path)
+    fmt = detect_format(path.name, fmt)
+    conn = connect()
+    cur = conn.cursor()
+
+    inserted = failed = 0
+    with open(path, encoding="utf-8", newline="") as f:
+        for trips, errors in iter_trip_chunks(f, fmt, chunk_size):
+            for error in errors:
+                print(f"  ✗ {error}")
+            failed += len(errors)
+            if not trips:
+                continue
+
+            described = [trip for trip in trips if trip.description]
+            vectors = iter(embedding_service.generate_embeddings([trip.description for trip in described], batch_size))
+            rows = [
+                (trip.title, trip.description, trip.duration, trip.num_people, trip.activity_level, trip.budget,
+                 trip.cities, trip.lat, trip.lng,
+                 embedding_service.serialize_embedding(next(vectors)) if trip.description else None)
+                for trip in trips
+            ]
+
+            last_id = cur.execute("SELECT COALESCE(MAX(trip_id), 0) FROM trips").fetchone()[0]
+            cur.executemany("""
+                INSERT INTO trips (title, description, duration, num_people, activity_level, budget, cities, lat, lng, embedding)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            if vector_search_service.backend == "sqlite-vec":
+                # Rows inserted by this transaction; strip the format header to get raw float32 for vec0.
+                cur.execute(f"""
+                    INSERT INTO {TRIP_VEC_TABLE} (trip_id, embedding)
+                    SELECT trip_id, substr(embedding, ?) FROM trips
+                    WHERE trip_id > ? AND embedding IS NOT NULL
+                """, (len(EMBEDDING_HEADER) + 1, last_id))
+            conn.commit()
+
+            inserted += len(rows)
+            print(f"  ✓ Imported {inserted} trips...")
+
+    conn.close()
+    print(f"Trip import complete: {inserted} inserted, {failed} rejected.")
+
+def migrate_embeddings(batch_size=500):
+    """Rewrite legacy JSON-text embeddings as packed float32 BLOBs, in batches.
+
+    Safe to re-run: only rows whose embedding is still stored as TEXT are touched, and
+    readers accept both formats while the migration is in progress.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+
+    migrated = 0
+    while True:
+        rows = cur.execute(
+            "SELECT trip_id, embedding FROM trips WHERE typeof(embedding) = 'text' LIMIT ?",
+            (batch_size,)
+        ).fetchall()
+        if not rows:
+            break
+
+        cur.executemany(
+            "UPDATE trips SET embedding = ? WHERE trip_id = ?",
+            [(embedding_service.serialize_embedding(json.loads(embedding)), trip_id) for trip_id, embedding in rows]
+        )
+        conn.commit()
+        migrated += len(rows)
+        print(f"  ✓ Migrated {migrated} embeddings...")
+
+    conn.close()
+    print(f"Embedding migration complete: {migrated} rows converted to packed float32.")
+
+def check_wal(seconds=3.0):
+    """Time reads on one connection while another commits writes back to back.
+
+    Under WAL the read latencies should stay flat and no read should hit SQLITE_BUSY; in
+    rollback-journal mode readers stall behind each commit's exclusive lock.
+    """
+    writer = sqlite3.connect(DB_PATH, check_same_thread=False)
+    reader = sqlite3.connect(DB_PATH)
+    apply_sqlite_pragmas(writer)
+    apply_sqlite_pragmas(reader)
+    journal_mode = reader.execute("PRAGMA journal_mode").fetchone()[0]
+    target = writer.execute("SELECT MIN(trip_id) FROM trips").fetchone()[0]
+    if target is None:
+        print("No trips to write to; run init first.")
+        return
+
+    stop = threading.Event()
+    commits = 0
+
+    def write_loop():
+        nonlocal commits
+        while not stop.is_set():
+            # Rewrites the row with its own value: a real write transaction that changes nothing.
+            writer.execute("BEGIN IMMEDIATE")
+            writer.execute("UPDATE trips SET title = title WHERE trip_id = ?", (target,))
+            writer.commit()
+            commits += 1
+
+    thread = threading.Thread(target=write_loop, daemon=True)
+    thread.start()
+    latencies, busy = [], 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            reader.execute("SELECT COUNT(*), MAX(budget) FROM trips").fetchone()
+            latencies.append((time.perf_counter() - start) * 1000)
+        except sqlite3.OperationalError:
+            busy += 1
+    stop.set()
+    thread.join()
+    writer.close()
+    reader.close()
+
+    latencies.sort()
+    print(f"journal_mode={journal_mode} writer_commits={commits} reads={len(latencies)} busy_errors={busy}")
+    if latencies:
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"read latency ms: p50={statistics.median(latencies):.3f} p99={p99:.3f} max={latencies[-1]:.3f}")
+
 
 if __name__ == "__main__":
-    init_db()
-    insert_dummies()
+    parser = argparse.ArgumentParser(description="Roamly database setup")
+    parser.add_argument("command", nargs="?", default="init", choices=["init", "migrate-embeddings", "import-trips", "import-cities", "check-wal"])
+    parser.add_argument("path", nargs="?", help="CSV/JSONL file for import-trips, worldcities CSV for import-cities")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Input format (default: from file extension)")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Rows per transaction")
+    parser.add_argument("--batch-size", type=int, default=64, help="Texts per embedding forward pass")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Duration of check-wal")
+    args = parser.parse_args()
+
+    if args.command == "migrate-embeddings":
+        migrate_embeddings()
+    elif args.command == "import-cities":
+        import_cities(args.path or "worldcities.csv", args.chunk_size)
+    elif args.command == "check-wal":
+        check_wal(args.seconds)
+    elif args.command == "import-trips":
+        if not args.path:
+            parser.error("import-trips requires a file path")
+        init_db()
+        import_trips(args.path, args.format, args.chunk_size, args.batch_size)
+    else:
+        init_db()
+        insert_dummies()
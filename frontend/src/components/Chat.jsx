@@ -7,6 +7,8 @@ import TripPlanContainer from "./TripPlanContainer";
 import { getSessionId } from "../session";
 import { MarkdownRenderer } from "../utils/markdownUtils";
 
+const STREAMED_STAGES = ["transport", "accommodation", "tips", "risks"];
+
 function Chat({ onSelectAttractions, initialMessage, onMessageSent }) {
   const [message, setMessage] = useState("");
   const [chat, setChat] = useState([]);
@@ -103,6 +105,7 @@ function Chat({ onSelectAttractions, initialMessage, onMessageSent }) {
         body: JSON.stringify({
           session_id: sid,
           message: tripQuery,
+          stream: true,
         }),
       });
 
@@ -112,13 +115,18 @@ function Chat({ onSelectAttractions, initialMessage, onMessageSent }) {
 
       const reader = response.body.getReader();
       const decoder = new TextDecoder();
+      let buffer = "";
+      // Planner days arrive one by one before the full plan; keyed by day number so a retry replaces them
+      const planDays = {};
 
       while (true) {
         const { value, done } = await reader.read();
         if (done) break;
 
-        const chunk = decoder.decode(value);
-        const lines = chunk.split("\n");
+        // Keep any partial line until the rest of it arrives in the next chunk
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
 
         for (const line of lines) {
           if (line.startsWith("data: ")) {
@@ -136,6 +144,26 @@ function Chat({ onSelectAttractions, initialMessage, onMessageSent }) {
             try {
               const parsed = JSON.parse(data);
               const { stage, result } = parsed;
+              if (parsed.error) {
+                console.error(`Stage ${stage} failed:`, parsed.error);
+                continue;
+              }
+              if (parsed.type === "day") {
+                planDays[parsed.day.day] = parsed.day;
+                const daily_plan = Object.values(planDays).sort((a, b) => a.day - b.day);
+                setTripPlan((prev) => ({ ...prev, plan: JSON.stringify({ daily_plan }) }));
+                continue;
+              }
+              if (parsed.type === "token") {
+                // Only prose stages are rendered token by token; the plan streams as whole days
+                if (STREAMED_STAGES.includes(stage)) {
+                  setTripPlan((prev) => ({ ...prev, [stage]: (prev[stage] || "") + parsed.token }));
+                }
+                continue;
+              }
+              if (parsed.type) {
+                continue;
+              }
               console.log(result);
 
               // Extract the actual output text from the agent response object
@@ -1,15 +1,59 @@
+import time
+_import_start = time.perf_counter()
+
 from fastapi import FastAPI, WebSocket, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from passlib.context import CryptContext
+from contextlib import asynccontextmanager
 from typing import List
+import asyncio
 import os
 
-from app.routers import trips, chat
+from app.routers import trips, chat, health, cities
+from app.utils.lazy import components, record_phase, warmup
+from app.database import close_db
+from app.utils.http import close_http_client
+from app.utils.sessions import compact_sessions_periodically
+
+record_phase("import", time.perf_counter() - _import_start)
+
+def warmup_targets() -> List[str]:
+    """Components to build at startup: WARMUP_COMPONENTS is a comma list, "all", or empty for fully lazy."""
+    value = os.getenv("WARMUP_COMPONENTS", "vector_index,token_encoding").strip()
+    if value == "all":
+        return list(components)
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+def timed_warmup(names: List[str]):
+    start = time.perf_counter()
+    warmup(names)
+    record_phase("warmup", time.perf_counter() - start)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    names = warmup_targets()
+    warmup_task = None
+    if names:
+        if os.getenv("WARMUP_BLOCKING", "false").lower() in ("1", "true", "yes"):
+            await asyncio.to_thread(timed_warmup, names)
+        else:
+            # Serve traffic immediately; /health/ready reports when the components are warm.
+            warmup_task = asyncio.create_task(asyncio.to_thread(timed_warmup, names))
+    compaction_task = asyncio.create_task(compact_sessions_periodically())
+    record_phase("startup", time.perf_counter() - _import_start)
+    yield
+    compaction_task.cancel()
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    await close_http_client()
+    await close_db()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.include_router(trips.router)
 app.include_router(chat.router)
+app.include_router(health.router)
+app.include_router(cities.router)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 